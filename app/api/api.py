@@ -1,7 +1,8 @@
 from fastapi import APIRouter
 
-from app.api.endpoints import auth, users
+from app.api.endpoints import api_keys, auth, users
 
 api_router = APIRouter()
 api_router.include_router(auth.router, prefix="/auth", tags=["authentication"])
-api_router.include_router(users.router, prefix="/users", tags=["users"]) 
\ No newline at end of file
+api_router.include_router(users.router, prefix="/users", tags=["users"]) 
+api_router.include_router(api_keys.router, prefix="/api-keys", tags=["api keys"])
\ No newline at end of file
@@ -1,30 +1,66 @@
-from typing import Generator, Optional
+from typing import AsyncGenerator, Optional
 
 from fastapi import Depends, HTTPException, status
-from fastapi.security import OAuth2PasswordBearer
+from fastapi.concurrency import run_in_threadpool
+from fastapi.security import APIKeyHeader, OAuth2PasswordBearer
 from jose import jwt
 from pydantic import ValidationError
+from sqlalchemy.engine import Row
 from sqlalchemy.orm import Session
 
-from app.db.session import get_db
+from app.db.session import LazySession, SessionLocal, get_db, replica_router
 from app.models.user import User
 from app.schemas.token import TokenPayload
+from app.services.api_key_service import ApiKeyService, CachedApiKey
 from app.services.token_service import TokenService
-from app.services.user_service import UserService
+from app.services.user_service import Principal, UserService
 from app.services.auth_service import AuthorizationService, ResourceEnum, ActionEnum
 from app.core.config import settings
 
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl=f"{settings.API_V1_STR}/auth/login")
+# Dependencies that do no I/O are declared async so FastAPI runs them on the
+# event loop instead of sending each one through the worker thread pool
 
+oauth2_scheme = OAuth2PasswordBearer(
+    tokenUrl=f"{settings.API_V1_STR}/auth/login", auto_error=False
+)
+api_key_header = APIKeyHeader(name="X-API-Key", auto_error=False)
 
-def get_current_user(
+
+async def get_api_key(
     db: Session = Depends(get_db),
-    token: str = Depends(oauth2_scheme),
-) -> User:
+    api_key: Optional[str] = Depends(api_key_header),
+) -> Optional[CachedApiKey]:
+    """
+    Validate the API key sent by service accounts, if any. Only a key cache
+    miss goes to the database
+    """
+    if api_key is None:
+        return None
+    
+    hit, key = ApiKeyService.authenticate_cached(api_key)
+    if not hit:
+        key = await run_in_threadpool(ApiKeyService.authenticate, db, api_key)
+    
+    if not key:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid API key",
+        )
+    
+    return key
+
+
+async def get_current_user_id(
+    token: Optional[str] = Depends(oauth2_scheme),
+    api_key: Optional[CachedApiKey] = Depends(get_api_key),
+) -> str:
     """
-    Get the current user from the token
+    Get the id of the authenticated user from the API key or the bearer token
     """
-    token_data = TokenService.validate_access_token(token)
+    if api_key is not None:
+        return str(api_key.user_id)
+    
+    token_data = TokenService.validate_access_token(token) if token else None
     
     if not token_data:
         raise HTTPException(
@@ -33,38 +69,169 @@ def get_current_user(
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    user = UserService.get_by_id(db, user_id=token_data.sub)
+    return token_data.sub
+
+
+async def get_user_db(
+    db: Session = Depends(get_db),
+    user_id: str = Depends(get_current_user_id),
+) -> Session:
+    """
+    Get the primary session tagged with the current user, so that its
+    commits keep the user's follow-up reads off the replicas
+    """
+    db.info["sticky_key"] = user_id
+    return db
+
+
+async def get_read_db(
+    db: Session = Depends(get_user_db),
+    user_id: str = Depends(get_current_user_id),
+) -> AsyncGenerator[Session, None]:
+    """
+    Get a session for read-only work, served by a replica when one is healthy
+    and the user has not written to the primary within the last few seconds
+    """
+    if not replica_router.engines:
+        yield db
+        return
     
-    if not user:
+    read_db = LazySession(
+        lambda: replica_router.session(key=user_id) or SessionLocal()
+    )
+    try:
+        yield read_db
+    finally:
+        # Closing may return a connection to the pool, which can block
+        await run_in_threadpool(read_db.close)
+
+
+def _reject_api_key(api_key: Optional[CachedApiKey]) -> None:
+    # Self-service endpoints (own profile, logout) are not covered by any
+    # scope, so a key of any scope would otherwise reach them
+    if api_key is not None:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="API keys cannot be used for this endpoint",
+        )
+
+
+def _check_active(user) -> None:
+    if not UserService.is_active(user):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Inactive user",
+        )
+
+
+async def get_current_principal(
+    db: Session = Depends(get_read_db),
+    user_id: str = Depends(get_current_user_id),
+    api_key: Optional[CachedApiKey] = Depends(get_api_key),
+) -> Principal:
+    """
+    Get the id, role and active flag of the current user. API key requests
+    are served from the key cache without a query
+    """
+    if api_key is not None:
+        return Principal(
+            id=api_key.user_id,
+            role=api_key.role,
+            is_active=api_key.user_is_active,
+            scopes=api_key.scopes,
+        )
+    
+    principal = await run_in_threadpool(UserService.get_principal, db, user_id)
+    
+    if not principal:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="User not found",
         )
     
-    return user
+    return principal
 
 
-def get_current_active_user(
-    current_user: User = Depends(get_current_user),
-) -> User:
+async def get_current_active_user(
+    principal: Principal = Depends(get_current_principal),
+) -> Principal:
     """
     Get the current active user
     """
-    if not UserService.is_active(current_user):
+    _check_active(principal)
+    return principal
+
+
+async def get_current_token_user(
+    principal: Principal = Depends(get_current_active_user),
+    api_key: Optional[CachedApiKey] = Depends(get_api_key),
+) -> Principal:
+    """
+    Get the current active user of a self-service endpoint, which requires a
+    bearer token
+    """
+    _reject_api_key(api_key)
+    return principal
+
+
+def get_current_profile(
+    db: Session = Depends(get_read_db),
+    user_id: str = Depends(get_current_user_id),
+    api_key: Optional[CachedApiKey] = Depends(get_api_key),
+) -> Row:
+    """
+    Get the public profile columns of the current active user in one query,
+    for GET /users/me. Requires a bearer token
+    """
+    _reject_api_key(api_key)
+    
+    profile = UserService.get_profile(db, user_id=user_id)
+    
+    if not profile:
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Inactive user",
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User not found",
+        )
+    
+    _check_active(profile)
+    return profile
+
+
+def get_current_user(
+    db: Session = Depends(get_user_db),
+    user_id: str = Depends(get_current_user_id),
+    api_key: Optional[CachedApiKey] = Depends(get_api_key),
+) -> User:
+    """
+    Get the full current user from the primary database, for self-service
+    endpoints that modify it. Requires a bearer token
+    """
+    _reject_api_key(api_key)
+    
+    user = UserService.get_by_id(db, user_id=user_id)
+    
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User not found",
         )
     
-    return current_user
+    _check_active(user)
+    return user
 
 
 def check_permission(resource: ResourceEnum, action: ActionEnum):
     """
     Check if the current user has permission to perform an action on a resource
     """
-    def dependency(current_user: User = Depends(get_current_active_user)) -> User:
-        if not AuthorizationService.is_authorized(current_user.role, resource, action):
+    async def dependency(
+        current_user: Principal = Depends(get_current_active_user),
+    ) -> Principal:
+        # API keys are further limited to the scopes they were issued with
+        if not AuthorizationService.is_authorized(current_user.role, resource, action) or (
+            current_user.scopes is not None
+            and not ApiKeyService.has_scope(current_user, resource, action)
+        ):
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail=f"Not enough permissions to {action} {resource}",
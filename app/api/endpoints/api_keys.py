@@ -0,0 +1,89 @@
+import uuid
+from typing import Any, List
+from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy.orm import Session
+
+from app.api.deps import check_permission, get_db
+from app.api.routing import SessionReleasingRoute
+from app.models.user import RoleEnum
+from app.schemas.api_key import ApiKey as ApiKeySchema, ApiKeyCreate, ApiKeyCreated
+from app.services.api_key_service import ApiKeyService
+from app.services.audit_service import AuditEventType, audit_logger
+from app.services.auth_service import ResourceEnum, ActionEnum
+from app.services.user_service import Principal, UserService
+
+router = APIRouter(route_class=SessionReleasingRoute)
+
+
+@router.post("", response_model=ApiKeyCreated, status_code=status.HTTP_201_CREATED)
+def create_api_key(
+    key_in: ApiKeyCreate,
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(check_permission(ResourceEnum.SERVICES, ActionEnum.CREATE)),
+) -> Any:
+    """
+    Create an API key for a service account - requires CREATE permission on services.
+    The key is only returned in this response
+    """
+    user = UserService.get_by_id(db, user_id=key_in.user_id)
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User not found",
+        )
+    
+    if user.role != RoleEnum.SERVICE:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="API keys can only be issued to service accounts",
+        )
+    
+    db_api_key, api_key = ApiKeyService.create(db, user=user, key_in=key_in)
+    audit_logger.log(
+        AuditEventType.API_KEY_CREATED,
+        user_id=current_user.id,
+        target_user_id=user.id,
+        api_key_id=db_api_key.id,
+    )
+    return ApiKeyCreated(
+        **ApiKeySchema.model_validate(db_api_key, from_attributes=True).model_dump(),
+        key=api_key,
+    )
+
+
+@router.get("", response_model=List[ApiKeySchema])
+def read_api_keys(
+    user_id: uuid.UUID,
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(check_permission(ResourceEnum.SERVICES, ActionEnum.LIST)),
+) -> Any:
+    """
+    List the API keys of a service account - requires LIST permission on services
+    """
+    return ApiKeyService.get_multi_by_user(db, user_id=user_id)
+
+
+@router.delete("/{api_key_id}", response_model=ApiKeySchema)
+def revoke_api_key(
+    api_key_id: uuid.UUID,
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(check_permission(ResourceEnum.SERVICES, ActionEnum.DELETE)),
+) -> Any:
+    """
+    Revoke an API key - requires DELETE permission on services
+    """
+    db_api_key = ApiKeyService.get_by_id(db, api_key_id=api_key_id)
+    if not db_api_key:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="API key not found",
+        )
+    
+    db_api_key = ApiKeyService.revoke(db, db_api_key=db_api_key)
+    audit_logger.log(
+        AuditEventType.API_KEY_REVOKED,
+        user_id=current_user.id,
+        target_user_id=db_api_key.user_id,
+        api_key_id=db_api_key.id,
+    )
+    return db_api_key
@@ -1,19 +1,21 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Response
+from fastapi import APIRouter, Depends, HTTPException, Request, status, Response
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 
-from app.api.deps import get_current_active_user
+from app.api.deps import get_current_token_user
+from app.api.routing import SessionReleasingRoute
 from app.db.session import get_db
-from app.models.user import User
 from app.schemas.token import Token
+from app.services.audit_service import AuditEventType, audit_logger
 from app.services.token_service import TokenService
-from app.services.user_service import UserService
+from app.services.user_service import Principal, UserService
 
-router = APIRouter()
+router = APIRouter(route_class=SessionReleasingRoute)
 
 
 @router.post("/login", response_model=Token)
 def login_access_token(
+    request: Request,
     db: Session = Depends(get_db),
     form_data: OAuth2PasswordRequestForm = Depends(),
 ) -> Token:
@@ -24,7 +26,12 @@ def login_access_token(
         db, email=form_data.username, password=form_data.password
     )
     
+    client_host = request.client.host if request.client else None
+    
     if not user:
+        audit_logger.log(
+            AuditEventType.LOGIN_FAILED, email=form_data.username, ip=client_host
+        )
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
@@ -38,6 +45,7 @@ def login_access_token(
         )
     
     access_token, refresh_token = TokenService.create_tokens(user, db)
+    audit_logger.log(AuditEventType.LOGIN, user_id=user.id, ip=client_host)
     
     return Token(
         access_token=access_token,
@@ -77,12 +85,13 @@ def logout(
     refresh_token: str,
     response: Response,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_active_user),
+    current_user: Principal = Depends(get_current_token_user),
 ):
     """
     Logout by revoking the refresh token
     """
     TokenService.revoke_refresh_token(refresh_token, db)
+    audit_logger.log(AuditEventType.LOGOUT, user_id=current_user.id)
     response.status_code = status.HTTP_204_NO_CONTENT
 
 
@@ -90,10 +99,11 @@ def logout(
 def logout_all(
     response: Response,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_active_user),
+    current_user: Principal = Depends(get_current_token_user),
 ):
     """
     Logout from all devices by revoking all refresh tokens for the user
     """
     TokenService.revoke_all_user_tokens(current_user.id, db)
+    audit_logger.log(AuditEventType.LOGOUT_ALL, user_id=current_user.id)
     response.status_code = status.HTTP_204_NO_CONTENT 
\ No newline at end of file
@@ -1,53 +1,80 @@
-from typing import Any, List
-from fastapi import APIRouter, Body, Depends, HTTPException, status, Response
+import base64
+import binascii
+import json
+import uuid
+from typing import Any, List, Optional, Tuple
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, status, Response
 from fastapi.encoders import jsonable_encoder
+from sqlalchemy.engine import Row
 from sqlalchemy.orm import Session
 
-from app.api.deps import get_current_active_user, check_permission, get_db
+from app.api.deps import (
+    get_current_profile,
+    get_current_user,
+    check_permission,
+    get_db,
+    get_read_db,
+    get_user_db,
+)
+from app.api.routing import SessionReleasingRoute
 from app.models.user import User
-from app.schemas.user import User as UserSchema, UserCreate, UserUpdate
+from app.schemas.user import (
+    User as UserSchema, UserBulkFilter, UserBulkResult, UserCreate, UserSearchResult, UserUpdate
+)
+from app.services.api_key_service import ApiKeyService
+from app.services.audit_service import AuditEventType, audit_logger
 from app.services.auth_service import ResourceEnum, ActionEnum
-from app.services.user_service import UserService
+from app.services.token_service import TokenService
+from app.services.user_service import Principal, UserService
 
-router = APIRouter()
+router = APIRouter(route_class=SessionReleasingRoute)
 
 
 @router.get("/me", response_model=UserSchema)
 def read_user_me(
-    current_user: User = Depends(get_current_active_user),
+    profile: Row = Depends(get_current_profile),
 ) -> Any:
     """
     Get current user
     """
-    return current_user
+    return profile
 
 
 @router.put("/me", response_model=UserSchema)
 def update_user_me(
     user_in: UserUpdate,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_active_user),
+    db: Session = Depends(get_user_db),
+    current_user: User = Depends(get_current_user),
 ) -> Any:
     """
     Update current user
     """
-    # Prevent users from changing their own role
-    if user_in.role is not None and user_in.role != current_user.role:
+    # Prevent users from changing their own role. UserUpdate defaults role,
+    # so only a role sent in the request counts
+    role = user_in.dict(exclude_unset=True).get("role")
+    if role is not None and role != current_user.role:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Cannot change own role",
         )
     
     user = UserService.update(db, db_user=current_user, user_in=user_in)
+    UserService.forget_principals([user.id])
+    audit_logger.log(
+        AuditEventType.USER_UPDATED,
+        user_id=current_user.id,
+        target_user_id=user.id,
+        fields=sorted(user_in.dict(exclude_unset=True)),
+    )
     return user
 
 
 @router.get("", response_model=List[UserSchema])
 def read_users(
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     skip: int = 0,
     limit: int = 100,
-    current_user: User = Depends(check_permission(ResourceEnum.USERS, ActionEnum.LIST)),
+    current_user: Principal = Depends(check_permission(ResourceEnum.USERS, ActionEnum.LIST)),
 ) -> Any:
     """
     Retrieve users - requires LIST permission
@@ -60,7 +87,7 @@ def read_users(
 def create_user(
     user_in: UserCreate,
     db: Session = Depends(get_db),
-    current_user: User = Depends(check_permission(ResourceEnum.USERS, ActionEnum.CREATE)),
+    current_user: Principal = Depends(check_permission(ResourceEnum.USERS, ActionEnum.CREATE)),
 ) -> Any:
     """
     Create a new user - requires CREATE permission
@@ -73,14 +100,111 @@ def create_user(
             detail="The user with this email already exists",
         )
     
-    return UserService.create(db, user_in=user_in)
+    user = UserService.create(db, user_in=user_in)
+    audit_logger.log(
+        AuditEventType.USER_CREATED, user_id=current_user.id, target_user_id=user.id
+    )
+    return user
+
+
+def _encode_cursor(user: User) -> str:
+    data = json.dumps([user.email_lower, str(user.id)]).encode("utf-8")
+    return base64.urlsafe_b64encode(data).decode("ascii")
+
+
+def _decode_cursor(cursor: str) -> Tuple[str, uuid.UUID]:
+    try:
+        email_lower, user_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return str(email_lower), uuid.UUID(user_id)
+    except (binascii.Error, UnicodeError, ValueError, TypeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor",
+        )
+
+
+@router.get("/search", response_model=UserSearchResult)
+def search_users(
+    email: Optional[str] = Query(None, min_length=1, description="Email prefix"),
+    name: Optional[str] = Query(None, min_length=1, description="Part of the full name"),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_read_db),
+    current_user: Principal = Depends(check_permission(ResourceEnum.USERS, ActionEnum.LIST)),
+) -> Any:
+    """
+    Search users by email prefix and/or full name, case-insensitively -
+    requires LIST permission
+    """
+    if not email and not name:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Provide an email prefix or a name to search for",
+        )
+    
+    after = _decode_cursor(cursor) if cursor else None
+    # One extra row tells whether there is a next page
+    users = UserService.search(db, email_prefix=email, name=name, limit=limit + 1, after=after)
+    next_cursor = _encode_cursor(users[limit - 1]) if len(users) > limit else None
+    return {"items": users[:limit], "next_cursor": next_cursor}
+
+
+def _check_bulk_filter(user_filter: UserBulkFilter) -> None:
+    # An empty filter would match every user
+    if not user_filter.dict(exclude_none=True):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="At least one filter is required",
+        )
+
+
+@router.post("/bulk-deactivate", response_model=UserBulkResult)
+def bulk_deactivate_users(
+    user_filter: UserBulkFilter,
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(check_permission(ResourceEnum.USERS, ActionEnum.UPDATE)),
+) -> Any:
+    """
+    Deactivate the users matching a filter and revoke their tokens and API
+    keys - requires UPDATE permission. The current user is never affected
+    """
+    _check_bulk_filter(user_filter)
+    user_ids = UserService.bulk_deactivate(db, user_filter, exclude_user_id=current_user.id)
+    TokenService.forget_users(user_ids)
+    ApiKeyService.forget_users(user_ids)
+    UserService.forget_principals(user_ids)
+    audit_logger.log(
+        AuditEventType.USERS_DEACTIVATED, user_id=current_user.id, target_user_ids=user_ids
+    )
+    return {"affected": len(user_ids)}
+
+
+@router.post("/bulk-delete", response_model=UserBulkResult)
+def bulk_delete_users(
+    user_filter: UserBulkFilter,
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(check_permission(ResourceEnum.USERS, ActionEnum.DELETE)),
+) -> Any:
+    """
+    Delete the users matching a filter with their tokens and API keys -
+    requires DELETE permission. The current user is never affected
+    """
+    _check_bulk_filter(user_filter)
+    user_ids = UserService.bulk_delete(db, user_filter, exclude_user_id=current_user.id)
+    TokenService.forget_users(user_ids)
+    ApiKeyService.forget_users(user_ids)
+    UserService.forget_principals(user_ids)
+    audit_logger.log(
+        AuditEventType.USERS_DELETED, user_id=current_user.id, target_user_ids=user_ids
+    )
+    return {"affected": len(user_ids)}
 
 
 @router.get("/{user_id}", response_model=UserSchema)
 def read_user_by_id(
-    user_id: str,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(check_permission(ResourceEnum.USERS, ActionEnum.READ)),
+    user_id: uuid.UUID,
+    db: Session = Depends(get_read_db),
+    current_user: Principal = Depends(check_permission(ResourceEnum.USERS, ActionEnum.READ)),
 ) -> Any:
     """
     Get a specific user by id - requires READ permission
@@ -96,10 +220,10 @@ def read_user_by_id(
 
 @router.put("/{user_id}", response_model=UserSchema)
 def update_user(
-    user_id: str,
+    user_id: uuid.UUID,
     user_in: UserUpdate,
     db: Session = Depends(get_db),
-    current_user: User = Depends(check_permission(ResourceEnum.USERS, ActionEnum.UPDATE)),
+    current_user: Principal = Depends(check_permission(ResourceEnum.USERS, ActionEnum.UPDATE)),
 ) -> Any:
     """
     Update a user - requires UPDATE permission
@@ -112,33 +236,48 @@ def update_user(
         )
     
     user = UserService.update(db, db_user=user, user_in=user_in)
+    # Cached API keys carry the account's role and active flag, and grace
+    # entries must not outlive a deactivation
+    TokenService.forget_users([user.id])
+    ApiKeyService.forget_users([user.id])
+    UserService.forget_principals([user.id])
+    audit_logger.log(
+        AuditEventType.USER_UPDATED,
+        user_id=current_user.id,
+        target_user_id=user.id,
+        fields=sorted(user_in.dict(exclude_unset=True)),
+    )
     return user
 
 
 @router.delete("/{user_id}")
 def delete_user(
-    user_id: str,
+    user_id: uuid.UUID,
     response: Response,
     db: Session = Depends(get_db),
-    current_user: User = Depends(check_permission(ResourceEnum.USERS, ActionEnum.DELETE)),
+    current_user: Principal = Depends(check_permission(ResourceEnum.USERS, ActionEnum.DELETE)),
 ):
     """
     Delete a user - requires DELETE permission
     """
-    user = UserService.get_by_id(db, user_id=user_id)
-    if not user:
+    if user_id == current_user.id:
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="User not found",
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Cannot delete yourself",
         )
     
-    if user.id == current_user.id:
+    # Refresh tokens and API keys are removed by the database cascade
+    if not UserService.delete(db, user_id=user_id):
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Cannot delete yourself",
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User not found",
         )
     
-    db.delete(user)
-    db.commit()
+    TokenService.forget_users([user_id])
+    ApiKeyService.forget_users([user_id])
+    UserService.forget_principals([user_id])
+    audit_logger.log(
+        AuditEventType.USER_DELETED, user_id=current_user.id, target_user_id=user_id
+    )
     
     response.status_code = status.HTTP_204_NO_CONTENT 
\ No newline at end of file
@@ -0,0 +1,120 @@
+from typing import List, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+from starlette.types import Receive, Scope, Send
+
+from app.db.session import LazySession, SessionLocal
+from app.services.api_key_service import ApiKeyService, CachedApiKey
+from app.services.auth_service import AuthorizationService, ActionEnum, ResourceEnum
+from app.services.token_service import TokenService
+from app.services.user_service import Principal, UserService
+
+Headers = List[Tuple[bytes, bytes]]
+
+_UNAUTHORIZED_HEADERS: Headers = [
+    (b"content-length", b"0"),
+    (b"www-authenticate", b"Bearer"),
+]
+_FORBIDDEN_HEADERS: Headers = [(b"content-length", b"0")]
+
+
+def _authenticate_api_key(api_key: str) -> Optional[CachedApiKey]:
+    db = LazySession(SessionLocal)
+    try:
+        return ApiKeyService.authenticate(db, api_key)
+    finally:
+        db.close()
+
+
+def _load_principal(user_id: str) -> Optional[Principal]:
+    db = LazySession(SessionLocal)
+    try:
+        return UserService.load_principal(db, user_id)
+    finally:
+        db.close()
+
+
+def _is_authorized(
+    role: str, key: Optional[CachedApiKey], resource: bytes, action: bytes
+) -> bool:
+    try:
+        resource_enum = ResourceEnum(resource.decode("latin-1"))
+        action_enum = ActionEnum(action.decode("latin-1"))
+    except ValueError:
+        return False
+    if key is not None and not ApiKeyService.has_scope(key, resource_enum, action_enum):
+        return False
+    return AuthorizationService.is_authorized(role, resource_enum, action_enum)
+
+
+class VerifyEndpoint:
+    """
+    Forward-auth endpoint for reverse proxies (nginx auth_request, Traefik
+    ForwardAuth). It runs as a plain ASGI app, outside the FastAPI
+    dependency system, and only looks at the credentials. Bearer tokens are
+    checked against the user's current role and active flag, and API keys
+    against the key cache; both caches are short-lived and only a miss
+    touches the database.
+
+    The proxy can pass X-Auth-Resource and X-Auth-Action headers to also
+    check the RBAC matrix. Responses have no body: 200 with X-User-Id and
+    X-User-Role, 401 for missing or invalid credentials, 403 when the
+    requested permission is not granted
+    """
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        authorization = api_key = resource = action = None
+        for name, value in scope["headers"]:
+            if name == b"authorization":
+                authorization = value
+            elif name == b"x-api-key":
+                api_key = value
+            elif name == b"x-auth-resource":
+                resource = value
+            elif name == b"x-auth-action":
+                action = value
+
+        principal: Optional[Tuple[str, str]] = None
+        key: Optional[CachedApiKey] = None
+        if api_key is not None:
+            api_key_str = api_key.decode("latin-1")
+            hit, key = ApiKeyService.authenticate_cached(api_key_str)
+            if not hit:
+                # Only a cache miss touches the database, and that call blocks
+                key = await run_in_threadpool(_authenticate_api_key, api_key_str)
+            if key is not None and key.user_is_active:
+                principal = str(key.user_id), key.role.value
+        elif authorization is not None and authorization[:7].lower() == b"bearer ":
+            token_data = TokenService.validate_access_token(authorization[7:].decode("latin-1"))
+            if token_data is not None:
+                # The token's claims may be stale: go by the user's current
+                # role and active flag, cached for a few seconds
+                hit, user = UserService.get_cached_principal(token_data.sub)
+                if not hit:
+                    user = await run_in_threadpool(_load_principal, token_data.sub)
+                if user is not None and user.is_active:
+                    principal = token_data.sub, user.role.value
+
+        if principal is None:
+            await self._respond(send, 401, _UNAUTHORIZED_HEADERS)
+            return
+
+        user_id, role = principal
+        if resource is not None or action is not None:
+            if not _is_authorized(role, key, resource or b"", action or b""):
+                await self._respond(send, 403, _FORBIDDEN_HEADERS)
+                return
+
+        await self._respond(send, 200, [
+            (b"content-length", b"0"),
+            (b"x-user-id", user_id.encode("latin-1")),
+            (b"x-user-role", role.encode("latin-1")),
+        ])
+
+    @staticmethod
+    async def _respond(send: Send, status: int, headers: Headers) -> None:
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": b""})
+
+
+verify_endpoint = VerifyEndpoint()
@@ -0,0 +1,38 @@
+import asyncio
+import functools
+from typing import Any, Callable
+
+from fastapi.routing import APIRoute
+
+from app.db.session import release_request_sessions
+
+
+def release_sessions_after(endpoint: Callable[..., Any]) -> Callable[..., Any]:
+    """
+    Wrap an endpoint so the request's database connections go back to the
+    pool as soon as it returns, instead of after the response has been
+    serialized and sent
+    """
+    if asyncio.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                release_request_sessions()
+
+        return async_wrapper
+
+    @functools.wraps(endpoint)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        try:
+            return endpoint(*args, **kwargs)
+        finally:
+            release_request_sessions()
+
+    return wrapper
+
+
+class SessionReleasingRoute(APIRoute):
+    def __init__(self, path: str, endpoint: Callable[..., Any], **kwargs: Any) -> None:
+        super().__init__(path, release_sessions_after(endpoint), **kwargs)
@@ -1,6 +1,6 @@
 from pydantic import Field
 from pydantic_settings import BaseSettings
-from typing import List, Optional
+from typing import Dict, List, Optional
 import secrets
 
 
@@ -11,8 +11,71 @@ class Settings(BaseSettings):
     # JWT Settings
     SECRET_KEY: str = secrets.token_urlsafe(32)
     ALGORITHM: str = "HS256"
+    # "fast" uses the built-in HMAC implementation for HS256/384/512 and
+    # python-jose for anything else, "jose" always uses python-jose
+    JWT_BACKEND: str = "fast"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
     REFRESH_TOKEN_EXPIRE_DAYS: int = 7
+    # For this many seconds after a refresh token is rotated, presenting it
+    # again returns the same new token pair instead of failing
+    REFRESH_GRACE_SECONDS: int = 10
+    
+    # Group commit for refresh token issuance
+    REFRESH_TOKEN_GROUP_COMMIT: bool = False
+    GROUP_COMMIT_MAX_ROWS: int = 64
+    GROUP_COMMIT_MAX_DELAY_MS: int = 5
+    GROUP_COMMIT_TIMEOUT_SECONDS: float = 5.0
+    
+    # How long /auth/verify trusts a cached role and active flag of a user
+    PRINCIPAL_CACHE_SECONDS: int = 5
+    
+    # API keys for service accounts
+    API_KEY_CACHE_SECONDS: int = 60
+    API_KEY_LAST_USED_INTERVAL_SECONDS: int = 60
+    # Prefixes that matched no key are remembered this long, so made-up keys
+    # do not cost a query each
+    API_KEY_NEGATIVE_CACHE_SECONDS: int = 10
+    API_KEY_NEGATIVE_CACHE_SIZE: int = 10000
+    
+    # Audit log
+    AUDIT_ENABLED: bool = True
+    # "db" writes to the auditevent table, "file" to rotating JSON-lines files
+    AUDIT_SINK: str = "db"
+    AUDIT_FILE_PATH: str = "logs/audit.jsonl"
+    AUDIT_FILE_MAX_BYTES: int = 50 * 1024 * 1024
+    # With 0 backups the file is never rotated, like RotatingFileHandler
+    AUDIT_FILE_BACKUP_COUNT: int = 5
+    AUDIT_QUEUE_SIZE: int = 10000
+    AUDIT_BATCH_SIZE: int = 200
+    AUDIT_FLUSH_INTERVAL_MS: int = 500
+    # What to do when the queue is full: "drop" the event or "block" the
+    # request for up to AUDIT_BLOCK_TIMEOUT_MS before dropping it
+    AUDIT_OVERFLOW_POLICY: str = "drop"
+    AUDIT_BLOCK_TIMEOUT_MS: int = 100
+    
+    # Admission control: how many requests of each route class may run at
+    # once, and how long a request may wait for a slot before it is shed
+    # with a 503. Classes: login, refresh, verify, admin (user and API key
+    # management) and default; a limit of 0 disables limiting for the class.
+    # The limits must add up to at most THREADPOOL_SIZE so that an admitted
+    # request never waits for a thread behind another class
+    ADMISSION_CONTROL_ENABLED: bool = True
+    ADMISSION_LIMITS: Dict[str, int] = {
+        "login": 8,
+        "refresh": 8,
+        "verify": 8,
+        "admin": 4,
+        "default": 12,
+    }
+    ADMISSION_QUEUE_TIMEOUT_MS: Dict[str, int] = {
+        "login": 1000,
+        "refresh": 500,
+        "verify": 100,
+        "admin": 2000,
+        "default": 1000,
+    }
+    # Threads available to sync endpoints and dependencies
+    THREADPOOL_SIZE: int = 40
     
     # CORS
     BACKEND_CORS_ORIGINS: List[str] = ["*"]
@@ -23,6 +86,16 @@ class Settings(BaseSettings):
     POSTGRES_PASSWORD: str = "postgres"
     POSTGRES_DB: str = "auth_db"
     SQLALCHEMY_DATABASE_URI: Optional[str] = None
+    # Connection pool of each database engine (not used for SQLite)
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 30
+    DB_POOL_TIMEOUT: int = 30
+    DB_POOL_RECYCLE: int = 1800
+    
+    # Read replicas
+    SQLALCHEMY_REPLICA_URIS: List[str] = []
+    REPLICA_RETRY_SECONDS: int = 30
+    READ_YOUR_WRITES_SECONDS: int = 5
     
     class Config:
         env_file = ".env"
@@ -0,0 +1,159 @@
+import abc
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+import logging
+import time
+from typing import Any, Dict, Optional
+
+from jose import jwt, JWTError
+from pydantic import ValidationError
+
+from app.core.config import settings
+from app.schemas.token import TokenPayload
+
+logger = logging.getLogger(__name__)
+
+_HMAC_DIGESTS = {
+    "HS256": hashlib.sha256,
+    "HS384": hashlib.sha384,
+    "HS512": hashlib.sha512,
+}
+
+
+def _b64encode(data: bytes) -> bytes:
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+
+def _b64decode(data: bytes) -> bytes:
+    return base64.urlsafe_b64decode(data + b"=" * (-len(data) % 4))
+
+
+class JWTBackend(abc.ABC):
+    """
+    Encodes and decodes the service's access tokens
+    """
+
+    @abc.abstractmethod
+    def encode(self, claims: Dict[str, Any]) -> str:
+        ...
+
+    @abc.abstractmethod
+    def decode_access_token(self, token: str) -> Optional[TokenPayload]:
+        """
+        Verify the signature and the exp, sub and role claims of an access
+        token. Returns None for any invalid or expired token
+        """
+
+
+class JoseJWTBackend(JWTBackend):
+    """
+    python-jose based backend, supporting every algorithm jose does
+    """
+
+    def __init__(self, secret_key: str, algorithm: str):
+        self.secret_key = secret_key
+        self.algorithm = algorithm
+
+    def encode(self, claims: Dict[str, Any]) -> str:
+        return jwt.encode(claims, self.secret_key, algorithm=self.algorithm)
+
+    def decode_access_token(self, token: str) -> Optional[TokenPayload]:
+        try:
+            payload = jwt.decode(token, self.secret_key, algorithms=[self.algorithm])
+            token_data = TokenPayload(**payload)
+        except (JWTError, ValidationError):
+            return None
+
+        if token_data.exp < time.time():
+            return None
+
+        return token_data
+
+
+class HMACJWTBackend(JWTBackend):
+    """
+    Backend for the HS256/384/512 algorithms that keeps the keyed hash and
+    the encoded header around between calls, and checks the claims in the
+    same pass that parses them instead of going through pydantic
+    """
+
+    def __init__(self, secret_key: str, algorithm: str):
+        self.algorithm = algorithm
+        self._mac = hmac.new(secret_key.encode("utf-8"), digestmod=_HMAC_DIGESTS[algorithm])
+        header = json.dumps({"alg": algorithm, "typ": "JWT"}, separators=(",", ":"))
+        self._header_segment = _b64encode(header.encode("utf-8"))
+
+    def _sign(self, signing_input: bytes) -> bytes:
+        mac = self._mac.copy()
+        mac.update(signing_input)
+        return _b64encode(mac.digest())
+
+    def encode(self, claims: Dict[str, Any]) -> str:
+        payload = json.dumps(claims, separators=(",", ":")).encode("utf-8")
+        signing_input = self._header_segment + b"." + _b64encode(payload)
+        return (signing_input + b"." + self._sign(signing_input)).decode("ascii")
+
+    def decode_access_token(self, token: str) -> Optional[TokenPayload]:
+        try:
+            data = token.encode("ascii")
+        except UnicodeEncodeError:
+            return None
+
+        parts = data.split(b".")
+        if len(parts) != 3:
+            return None
+        header_segment, payload_segment, signature = parts
+
+        if header_segment != self._header_segment and not self._header_matches(header_segment):
+            return None
+
+        signing_input = data[:len(header_segment) + 1 + len(payload_segment)]
+        if not hmac.compare_digest(self._sign(signing_input), signature):
+            return None
+
+        try:
+            payload = json.loads(_b64decode(payload_segment))
+        except (binascii.Error, ValueError):
+            return None
+
+        if not isinstance(payload, dict):
+            return None
+        exp, sub, role = payload.get("exp"), payload.get("sub"), payload.get("role")
+        if (
+            not isinstance(exp, (int, float)) or isinstance(exp, bool)
+            or not isinstance(sub, str)
+            or not isinstance(role, str)
+        ):
+            return None
+
+        if exp < time.time():
+            return None
+
+        return TokenPayload.model_construct(sub=sub, exp=int(exp), role=role)
+
+    def _header_matches(self, header_segment: bytes) -> bool:
+        # Tokens issued by other libraries may serialize the same header
+        # differently, so fall back to parsing it
+        try:
+            header = json.loads(_b64decode(header_segment))
+        except (binascii.Error, ValueError):
+            return False
+        return isinstance(header, dict) and header.get("alg") == self.algorithm
+
+
+def get_jwt_backend() -> JWTBackend:
+    if settings.JWT_BACKEND == "fast":
+        if settings.ALGORITHM in _HMAC_DIGESTS:
+            return HMACJWTBackend(settings.SECRET_KEY, settings.ALGORITHM)
+        logger.warning(
+            "The fast JWT backend does not support %s, using python-jose", settings.ALGORITHM
+        )
+    elif settings.JWT_BACKEND != "jose":
+        raise ValueError(f"Unknown JWT backend {settings.JWT_BACKEND!r}")
+    return JoseJWTBackend(settings.SECRET_KEY, settings.ALGORITHM)
+
+
+jwt_backend = get_jwt_backend()
@@ -0,0 +1,192 @@
+import logging
+from typing import Any, Dict, Optional
+
+import anyio
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.config import settings
+from app.db.session import start_db_usage
+
+logger = logging.getLogger(__name__)
+
+
+class DBUsageMiddleware:
+    """
+    Track how long each request holds database connections and report it in
+    a Server-Timing response header
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        usage = start_db_usage()
+
+        async def send_with_timing(message: Message) -> None:
+            if message["type"] == "http.response.start" and usage.checkouts:
+                headers = list(message.get("headers", []))
+                headers.append(
+                    (b"server-timing", f"db;dur={usage.hold_time * 1000:.2f}".encode())
+                )
+                message["headers"] = headers
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            logger.debug(
+                "%s %s held database connections for %.2f ms (%d checkouts)",
+                scope["method"],
+                scope["path"],
+                usage.hold_time * 1000,
+                usage.checkouts,
+            )
+
+
+class AdmissionController:
+    """
+    Per route class concurrency limits. A request waits up to the class's
+    queue timeout for a slot and is rejected if none frees up, so a flood of
+    expensive requests cannot starve the cheap ones
+    """
+
+    def __init__(
+        self, limits: Dict[str, int], queue_timeouts_ms: Dict[str, int], api_prefix: str
+    ) -> None:
+        self.api_prefix = api_prefix
+        self._semaphores: Dict[str, Optional[anyio.Semaphore]] = {}
+        self._timeouts: Dict[str, float] = {}
+        self.shed: Dict[str, int] = {}
+        for route_class, limit in limits.items():
+            self._semaphores[route_class] = (
+                anyio.Semaphore(limit, max_value=limit) if limit > 0 else None
+            )
+            self._timeouts[route_class] = queue_timeouts_ms.get(route_class, 0) / 1000
+            self.shed[route_class] = 0
+
+    def check_capacity(self, threads: int, connections: Optional[int] = None) -> None:
+        """
+        Make sure every admitted request can get a worker thread, and
+        ideally a database connection, without waiting, so that a saturated
+        class cannot starve the others through the shared pools
+        """
+        unlimited = [name for name, semaphore in self._semaphores.items() if semaphore is None]
+        if unlimited:
+            logger.warning(
+                "Route classes %s have no admission limit and can take every worker thread",
+                ", ".join(unlimited),
+            )
+        admitted = sum(
+            semaphore.max_value for semaphore in self._semaphores.values() if semaphore is not None
+        )
+        if admitted > threads:
+            raise ValueError(
+                f"Admission limits allow {admitted} concurrent requests, "
+                f"more than THREADPOOL_SIZE ({threads})"
+            )
+        # Connections are only held while an endpoint runs, so this is not fatal
+        if connections is not None and admitted > connections:
+            logger.warning(
+                "Admission limits allow %d concurrent requests but the database pool "
+                "has %d connections",
+                admitted,
+                connections,
+            )
+
+    def classify(self, path: str) -> str:
+        if not path.startswith(self.api_prefix):
+            return "default"
+        path = path[len(self.api_prefix):]
+        if path == "/auth/login":
+            return "login"
+        if path == "/auth/refresh":
+            return "refresh"
+        if path == "/auth/verify":
+            return "verify"
+        if path.startswith("/users/me"):
+            return "default"
+        if path.startswith("/users") or path.startswith("/api-keys"):
+            return "admin"
+        return "default"
+
+    async def acquire(self, route_class: str) -> bool:
+        """
+        Wait for a slot of the class. Returns False if the request should be
+        shed
+        """
+        semaphore = self._semaphores.get(route_class)
+        if semaphore is None:
+            return True
+        try:
+            semaphore.acquire_nowait()
+            return True
+        except anyio.WouldBlock:
+            pass
+        timeout = self._timeouts[route_class]
+        if timeout > 0:
+            with anyio.move_on_after(timeout):
+                await semaphore.acquire()
+                return True
+        self.shed[route_class] += 1
+        return False
+
+    def release(self, route_class: str) -> None:
+        semaphore = self._semaphores.get(route_class)
+        if semaphore is not None:
+            semaphore.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            route_class: {
+                "limit": semaphore.max_value if semaphore is not None else None,
+                "in_flight": (
+                    semaphore.max_value - semaphore.value if semaphore is not None else None
+                ),
+                "shed": self.shed[route_class],
+            }
+            for route_class, semaphore in self._semaphores.items()
+        }
+
+
+admission_controller = AdmissionController(
+    settings.ADMISSION_LIMITS,
+    settings.ADMISSION_QUEUE_TIMEOUT_MS,
+    api_prefix=settings.API_V1_STR,
+)
+
+
+class AdmissionControlMiddleware:
+    """
+    Reject requests with a 503 when their route class is at its concurrency
+    limit for longer than its queue timeout
+    """
+
+    def __init__(self, app: ASGIApp, controller: AdmissionController) -> None:
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        route_class = self.controller.classify(scope["path"])
+        if not await self.controller.acquire(route_class):
+            logger.warning("Shedding %s %s (%s)", scope["method"], scope["path"], route_class)
+            response = JSONResponse(
+                {"detail": "Service overloaded, retry later"},
+                status_code=503,
+                headers={"Retry-After": "1"},
+            )
+            await response(scope, receive, send)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(route_class)
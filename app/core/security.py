@@ -1,21 +1,22 @@
-from datetime import datetime, timedelta
-from typing import Any, Union, Optional
-from jose import jwt
+from typing import Any, Tuple, Union, Optional
 from passlib.context import CryptContext
+import hashlib
+import hmac
+import secrets
+import time
 import uuid
 
 from app.core.config import settings
+from app.core.jwt_backend import jwt_backend
 
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 
 def create_access_token(subject: Union[str, Any], role: str) -> str:
-    expire = datetime.utcnow() + timedelta(
-        minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES
-    )
+    expire = int(time.time()) + settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60
     to_encode = {"exp": expire, "sub": str(subject), "role": role}
-    encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
+    encoded_jwt = jwt_backend.encode(to_encode)
     return encoded_jwt
 
 
@@ -23,6 +24,27 @@ def create_refresh_token() -> str:
     return str(uuid.uuid4())
 
 
+def create_api_key() -> Tuple[str, str]:
+    """
+    Generate a new API key, returned as (prefix, full key). The prefix is
+    stored in clear text to look the key up, the rest only as a digest
+    """
+    prefix = secrets.token_hex(6)
+    return prefix, f"{prefix}.{secrets.token_urlsafe(32)}"
+
+
+def get_api_key_digest(api_key: str) -> str:
+    # API keys are long random strings, so a keyed digest is enough and keeps
+    # per-request verification cheap compared to bcrypt
+    return hmac.new(
+        settings.SECRET_KEY.encode(), api_key.encode(), hashlib.sha256
+    ).hexdigest()
+
+
+def verify_api_key(api_key: str, key_digest: str) -> bool:
+    return hmac.compare_digest(get_api_key_digest(api_key), key_digest)
+
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
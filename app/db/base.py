@@ -1,3 +1,5 @@
 # Import all the models, so that Base has them before being imported by Alembic
 from app.db.base_class import Base  # noqa
-from app.models.user import User  # noqa 
\ No newline at end of file
+from app.models.user import User  # noqa 
+from app.models.api_key import ApiKey  # noqa
+from app.models.audit_event import AuditEvent  # noqa
\ No newline at end of file
@@ -0,0 +1,221 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, Generic, List, Optional, Tuple, TypeVar
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+_STOP = object()
+
+
+class BatchWriter(Generic[T]):
+    """
+    Background thread that takes items off a bounded queue and hands them to
+    `flush` in batches of up to `max_batch` items, waiting at most
+    `max_delay` seconds for a batch to fill up
+    """
+
+    def __init__(
+        self,
+        flush: Callable[[List[T]], None],
+        max_batch: int,
+        max_delay: float,
+        max_queue: int = 0,
+        name: str = "batch-writer",
+    ):
+        self.flush = flush
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.name = name
+        self.queued = 0
+        self.flushed = 0
+        self.failed = 0
+        self.batches = 0
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=max_queue)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """
+        Flush whatever is still queued and stop the writer thread
+        """
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(_STOP)
+            thread.join(timeout)
+
+    def put(self, item: T, block: bool = True, timeout: Optional[float] = None) -> bool:
+        """
+        Queue an item, starting the writer thread if needed. Returns False if
+        the queue stayed full
+        """
+        if self._thread is None:
+            self.start()
+        try:
+            self._queue.put(item, block=block, timeout=timeout)
+        except queue.Full:
+            return False
+        with self._stats_lock:
+            self.queued += 1
+        return True
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            stopping = False
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining > 0:
+                        item = self._queue.get(timeout=remaining)
+                    else:
+                        item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            self._flush(batch)
+            if stopping:
+                self._drain()
+                return
+
+    def _drain(self) -> None:
+        batch: List[T] = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                batch.append(item)
+        for start in range(0, len(batch), self.max_batch):
+            self._flush(batch[start:start + self.max_batch])
+
+    def _flush(self, batch: List[T]) -> None:
+        try:
+            self.flush(batch)
+        except Exception:
+            logger.exception("%s failed to flush %d items", self.name, len(batch))
+            self.failed += len(batch)
+            return
+        self.flushed += len(batch)
+        self.batches += 1
+
+
+class GroupCommitWriter:
+    """
+    Insert rows of a model from many concurrent callers with one multi-row
+    INSERT and one commit per batch. `write` returns once the batch holding
+    the row has been committed, and raises the error of its own row only: a
+    failed batch is retried row by row
+    """
+
+    def __init__(
+        self,
+        model: Any,
+        session_factory: Callable[[], Session],
+        max_rows: int,
+        max_delay: float,
+        timeout: float,
+    ):
+        self.model = model
+        self.session_factory = session_factory
+        self.timeout = timeout
+        self.writer: BatchWriter[Tuple[Dict[str, Any], Future]] = BatchWriter(
+            self._flush,
+            max_batch=max_rows,
+            max_delay=max_delay,
+            name=f"group-commit-{model.__tablename__}",
+        )
+
+    def write(self, row: Dict[str, Any]) -> None:
+        future: Future = Future()
+        self.writer.put((row, future))
+        try:
+            future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            # A row the writer has not picked up yet can be withdrawn and
+            # inserted directly; one already being written is waited for
+            if not future.cancel():
+                future.result()
+                return
+            logger.warning("%s timed out, inserting directly", self.writer.name)
+            db = self.session_factory()
+            try:
+                db.execute(insert(self.model), row)
+                db.commit()
+            finally:
+                db.close()
+
+    def stop(self) -> None:
+        self.writer.stop()
+
+    def _flush(self, batch: List[Tuple[Dict[str, Any], Future]]) -> None:
+        # Rows withdrawn by callers that timed out are skipped
+        batch = [(row, future) for row, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+
+        db = self.session_factory()
+        try:
+            try:
+                db.execute(insert(self.model), [row for row, _ in batch])
+                db.commit()
+            except Exception:
+                db.rollback()
+                if len(batch) == 1:
+                    raise
+                logger.warning(
+                    "%s batch of %d rows failed, retrying row by row",
+                    self.writer.name,
+                    len(batch),
+                )
+                self._write_rows(db, batch)
+                return
+        except Exception as exc:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            raise
+        finally:
+            db.close()
+
+        for _, future in batch:
+            future.set_result(None)
+
+    def _write_rows(self, db: Session, batch: List[Tuple[Dict[str, Any], Future]]) -> None:
+        for row, future in batch:
+            try:
+                db.execute(insert(self.model), row)
+                db.commit()
+            except Exception as exc:
+                db.rollback()
+                future.set_exception(exc)
+            else:
+                future.set_result(None)
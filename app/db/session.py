@@ -1,15 +1,243 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+import itertools
+import logging
+import sqlite3
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Connection, Engine, make_url
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session, sessionmaker
 
 from app.core.config import settings
 
-engine = create_engine(settings.database_url)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+logger = logging.getLogger(__name__)
+
+
+@event.listens_for(Engine, "connect")
+def _enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    # SQLite ignores foreign keys, and so ON DELETE CASCADE, unless asked
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
+
+def engine_options(url: str) -> Dict[str, Any]:
+    """
+    Pool settings for an engine; SQLite uses its own pool classes
+    """
+    if make_url(url).get_backend_name() == "sqlite":
+        return {}
+    return {
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+    }
+
+
+engine = create_engine(settings.database_url, **engine_options(settings.database_url))
+# Objects stay loaded after commit so that serializing a response does not
+# check a connection out of the pool again just to reload them
+SessionLocal = sessionmaker(
+    autocommit=False, autoflush=False, expire_on_commit=False, bind=engine
+)
+
+
+class DBUsage:
+    """
+    Connection pool usage of a single request
+    """
+    __slots__ = ("hold_time", "checkouts", "sessions")
+
+    def __init__(self) -> None:
+        self.hold_time = 0.0
+        self.checkouts = 0
+        self.sessions: List["LazySession"] = []
+
+
+_db_usage: ContextVar[Optional[DBUsage]] = ContextVar("db_usage", default=None)
+
+
+def start_db_usage() -> DBUsage:
+    """
+    Start tracking connection usage for the current request
+    """
+    usage = DBUsage()
+    _db_usage.set(usage)
+    return usage
+
+
+def release_request_sessions() -> None:
+    """
+    Return the connections of the current request's sessions to the pool
+    """
+    usage = _db_usage.get()
+    if usage is None:
+        return
+    for session in usage.sessions:
+        session.release()
+
+
+def track_pool_usage(target: Engine) -> None:
+    """
+    Attribute the time connections of an engine spend checked out to requests
+    """
+    @event.listens_for(target, "checkout")
+    def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+        usage = _db_usage.get()
+        if usage is not None:
+            usage.checkouts += 1
+            connection_record.info["db_usage"] = (usage, time.perf_counter())
+
+    @event.listens_for(target, "checkin")
+    def _on_checkin(dbapi_connection, connection_record):
+        checkout = connection_record.info.pop("db_usage", None)
+        if checkout is not None:
+            usage, started = checkout
+            usage.hold_time += time.perf_counter() - started
+
+
+track_pool_usage(engine)
+
+
+class LazySession:
+    """
+    Stand-in for a Session that is only created when first used, so requests
+    that never touch the database never build a session or check out a
+    connection
+    """
+
+    def __init__(self, factory: Callable[[], Session]) -> None:
+        self._factory = factory
+        self._session: Optional[Session] = None
+        usage = _db_usage.get()
+        if usage is not None:
+            usage.sessions.append(self)
+
+    def __getattr__(self, name: str) -> Any:
+        if self._session is None:
+            self._session = self._factory()
+        return getattr(self._session, name)
+
+    def release(self) -> None:
+        """
+        Close the session unless it still has changes waiting for a commit.
+        Loaded objects stay usable and a new session is built on the next use
+        """
+        session = self._session
+        if session is None or session.new or session.dirty or session.deleted:
+            return
+        session.close()
+        self._session = None
+
+    def close(self) -> None:
+        if self._session is not None:
+            self._session.close()
+
+
+class ReplicaSession(Session):
+    """
+    Session that owns the replica connection it is bound to
+    """
+
+    def close(self) -> None:
+        super().close()
+        self.bind.close()
+
+
+class ReplicaRouter:
+    """
+    Hand out connections to read replicas, skipping replicas that recently
+    failed and keys (user ids) that wrote to the primary a moment ago
+    """
+
+    def __init__(self, urls: List[str], retry_seconds: int, sticky_seconds: int):
+        self.engines = [
+            create_engine(url, pool_pre_ping=True, **engine_options(url)) for url in urls
+        ]
+        for replica_engine in self.engines:
+            track_pool_usage(replica_engine)
+        self.retry_seconds = retry_seconds
+        self.sticky_seconds = sticky_seconds
+        self._down_until: Dict[int, float] = {}
+        self._recent_writes: Dict[str, float] = {}
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def record_write(self, key: str) -> None:
+        """
+        Pin reads for this key to the primary for the read-your-writes window
+        """
+        if not self.engines or self.sticky_seconds <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if len(self._recent_writes) > 10000:
+                self._recent_writes = {
+                    k: until for k, until in self._recent_writes.items() if until > now
+                }
+            self._recent_writes[key] = now + self.sticky_seconds
+
+    def is_sticky(self, key: str) -> bool:
+        until = self._recent_writes.get(key)
+        return until is not None and until > time.monotonic()
+
+    def connect(self, key: Optional[str] = None) -> Optional[Connection]:
+        """
+        Connect to the next healthy replica, or return None to use the primary
+        """
+        if not self.engines or (key is not None and self.is_sticky(key)):
+            return None
+
+        start = next(self._counter)
+        for offset in range(len(self.engines)):
+            index = (start + offset) % len(self.engines)
+            if self._down_until.get(index, 0) > time.monotonic():
+                continue
+            try:
+                connection = self.engines[index].connect()
+            except DBAPIError:
+                logger.warning("Read replica %d unavailable, failing over", index)
+                self._down_until[index] = time.monotonic() + self.retry_seconds
+                continue
+            self._down_until.pop(index, None)
+            return connection
+
+        return None
+
+    def session(self, key: Optional[str] = None) -> Optional[Session]:
+        """
+        Open a session on a healthy replica, or return None to use the primary
+        """
+        connection = self.connect(key=key)
+        if connection is None:
+            return None
+        return ReplicaSession(bind=connection, autoflush=False, expire_on_commit=False)
+
+
+replica_router = ReplicaRouter(
+    settings.SQLALCHEMY_REPLICA_URIS,
+    retry_seconds=settings.REPLICA_RETRY_SECONDS,
+    sticky_seconds=settings.READ_YOUR_WRITES_SECONDS,
+)
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _record_write(session: Session) -> None:
+    # Requests tag their primary session with the acting user so that a
+    # commit keeps that user's follow-up reads on the primary
+    key = session.info.get("sticky_key")
+    if key is not None:
+        replica_router.record_write(key)
 
 
 def get_db():
-    db = SessionLocal()
+    db = LazySession(SessionLocal)
     try:
         yield db
     finally:
-        db.close() 
\ No newline at end of file
+        db.close()
@@ -0,0 +1,56 @@
+import os
+import time
+import uuid
+from typing import Any, Optional
+
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.types import BINARY, TypeDecorator
+
+
+class GUID(TypeDecorator):
+    """
+    UUID column stored as the native uuid type on PostgreSQL and as 16 raw
+    bytes everywhere else. Accepts uuid.UUID objects or their string form
+    and always returns uuid.UUID objects
+    """
+    impl = BINARY(16)
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == "postgresql":
+            return dialect.type_descriptor(postgresql.UUID(as_uuid=True))
+        return dialect.type_descriptor(BINARY(16))
+
+    def process_bind_param(self, value: Any, dialect) -> Any:
+        if value is None:
+            return None
+        if not isinstance(value, uuid.UUID):
+            value = uuid.UUID(str(value))
+        if dialect.name == "postgresql":
+            return value
+        return value.bytes
+
+    def process_result_value(self, value: Any, dialect) -> Optional[uuid.UUID]:
+        if value is None or isinstance(value, uuid.UUID):
+            return value
+        return uuid.UUID(bytes=bytes(value))
+
+
+def uuid7() -> uuid.UUID:
+    """
+    Time-ordered UUID (version 7): a 48-bit millisecond timestamp followed by
+    random bits, so new primary keys land at the end of the index instead of
+    on random pages
+    """
+    timestamp_ms = time.time_ns() // 1_000_000
+    value = (timestamp_ms & 0xFFFFFFFFFFFF) << 80 | int.from_bytes(os.urandom(10), "big")
+    value = (value & ~(0xF << 76)) | (0x7 << 76)
+    value = (value & ~(0x3 << 62)) | (0x2 << 62)
+    return uuid.UUID(int=value)
+
+
+def parse_uuid(value: str) -> Optional[uuid.UUID]:
+    try:
+        return uuid.UUID(value)
+    except (TypeError, ValueError):
+        return None
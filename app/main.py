@@ -1,17 +1,30 @@
-from fastapi import FastAPI, Depends
+from fastapi import FastAPI, Depends, Request, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+from starlette.routing import Route
+import anyio.to_thread
 import uvicorn
 from sqlalchemy.orm import Session
-from sqlalchemy import text
+from sqlalchemy import exc, text
 
 from app.api.api import api_router
+from app.api.routing import SessionReleasingRoute
+from app.api.endpoints.verify import verify_endpoint
 from app.core.config import settings
-from app.db.session import get_db
+from app.core.middleware import (
+    AdmissionControlMiddleware, DBUsageMiddleware, admission_controller
+)
+from app.db.session import engine_options, get_db
+from app.services.api_key_service import last_used_writer
+from app.services.audit_service import audit_logger
+from app.services.token_service import refresh_token_writer
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
     openapi_url=f"{settings.API_V1_STR}/openapi.json",
 )
+# Routes declared on the app itself release their sessions like the API routers'
+app.router.route_class = SessionReleasingRoute
 
 # Set all CORS enabled origins
 if settings.BACKEND_CORS_ORIGINS:
@@ -23,8 +36,48 @@ if settings.BACKEND_CORS_ORIGINS:
         allow_headers=["*"],
     )
 
+app.add_middleware(DBUsageMiddleware)
+# Added last so it runs first, before any other work is done for a request
+if settings.ADMISSION_CONTROL_ENABLED:
+    admission_controller.check_capacity(
+        settings.THREADPOOL_SIZE,
+        connections=(
+            settings.DB_POOL_SIZE + settings.DB_MAX_OVERFLOW
+            if engine_options(settings.database_url) else None
+        ),
+    )
+    app.add_middleware(AdmissionControlMiddleware, controller=admission_controller)
+
 app.include_router(api_router, prefix=settings.API_V1_STR)
 
+# Forward-auth checks are served by a plain ASGI app, matched before any other
+# route, to keep reverse proxy subrequests off the FastAPI dependency chain
+app.router.routes.insert(
+    0, Route(f"{settings.API_V1_STR}/auth/verify", endpoint=verify_endpoint)
+)
+
+
+@app.on_event("startup")
+def configure_threadpool():
+    anyio.to_thread.current_default_thread_limiter().total_tokens = settings.THREADPOOL_SIZE
+
+
+@app.exception_handler(exc.TimeoutError)
+async def pool_timeout_handler(request: Request, error: exc.TimeoutError):
+    # No database connection freed up within DB_POOL_TIMEOUT
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Service overloaded, retry later"},
+        headers={"Retry-After": "1"},
+    )
+
+
+@app.on_event("shutdown")
+def stop_background_writers():
+    refresh_token_writer.stop()
+    last_used_writer.stop()
+    audit_logger.stop()
+
 
 @app.get("/")
 def root():
@@ -39,7 +92,12 @@ def health_check(db: Session = Depends(get_db)):
     # Check database connection by executing a simple query
     # Use text() to explicitly declare the SQL as text
     db.execute(text("SELECT 1"))
-    return {"status": "healthy", "service": settings.PROJECT_NAME}
+    return {
+        "status": "healthy",
+        "service": settings.PROJECT_NAME,
+        "audit": audit_logger.stats(),
+        "admission": admission_controller.stats(),
+    }
 
 
 if __name__ == "__main__":
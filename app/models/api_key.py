@@ -0,0 +1,22 @@
+from sqlalchemy import Boolean, Column, String, DateTime, ForeignKey
+from sqlalchemy.orm import relationship
+from datetime import datetime
+
+from app.db.base_class import Base
+from app.db.types import GUID, uuid7
+
+
+class ApiKey(Base):
+    id = Column(GUID, primary_key=True, index=True, default=uuid7)
+    user_id = Column(GUID, ForeignKey("user.id", ondelete="CASCADE"), nullable=False, index=True)
+    name = Column(String, nullable=False)
+    prefix = Column(String, unique=True, index=True, nullable=False)
+    key_digest = Column(String, nullable=False)
+    # Space separated "resource:action" pairs
+    scopes = Column(String, nullable=False, default="")
+    is_active = Column(Boolean, default=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=True)
+    last_used_at = Column(DateTime, nullable=True)
+    
+    user = relationship("User", back_populates="api_keys")
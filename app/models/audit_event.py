@@ -0,0 +1,13 @@
+from sqlalchemy import Column, String, DateTime, JSON
+from datetime import datetime
+
+from app.db.base_class import Base
+from app.db.types import GUID, uuid7
+
+
+class AuditEvent(Base):
+    id = Column(GUID, primary_key=True, index=True, default=uuid7)
+    event_type = Column(String, nullable=False, index=True)
+    user_id = Column(GUID, nullable=True, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    details = Column(JSON, nullable=True)
@@ -1,9 +1,14 @@
-from sqlalchemy import Boolean, Column, String, DateTime, Enum, ForeignKey, Table, Integer
-from sqlalchemy.orm import relationship
+from sqlalchemy import (
+    DDL, Boolean, Column, String, DateTime, Enum, ForeignKey, Index, Table, Integer, event
+)
+from sqlalchemy.orm import relationship, validates
 import enum
 from datetime import datetime
 
 from app.db.base_class import Base
+from app.db.types import GUID, uuid7
+# Imported so the relationship to ApiKey resolves wherever User is used
+from app.models.api_key import ApiKey  # noqa
 
 
 class RoleEnum(str, enum.Enum):
@@ -13,8 +18,13 @@ class RoleEnum(str, enum.Enum):
 
 
 class User(Base):
-    id = Column(String, primary_key=True, index=True)
+    id = Column(GUID, primary_key=True, index=True, default=uuid7)
     email = Column(String, unique=True, index=True, nullable=False)
+    # Lowercased copy of email for case-insensitive search. The "C" collation
+    # on PostgreSQL makes its btree index usable for prefix ranges and ordering
+    email_lower = Column(
+        String().with_variant(String(collation="C"), "postgresql"), nullable=False
+    )
     hashed_password = Column(String, nullable=False)
     full_name = Column(String, nullable=True)
     is_active = Column(Boolean, default=True)
@@ -22,13 +32,45 @@ class User(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
-    refresh_tokens = relationship("RefreshToken", back_populates="user", cascade="all, delete-orphan")
+    # Rows are removed by ON DELETE CASCADE, without loading them first
+    refresh_tokens = relationship(
+        "RefreshToken", back_populates="user", cascade="all, delete-orphan", passive_deletes=True
+    )
+    api_keys = relationship(
+        "ApiKey", back_populates="user", cascade="all, delete-orphan", passive_deletes=True
+    )
+    
+    __table_args__ = (
+        # Search results are ordered and continued by (email_lower, id)
+        Index("ix_user_email_lower_id", "email_lower", "id"),
+        # Trigram index for full_name substring (ILIKE) search on PostgreSQL;
+        # other databases scan for name matches
+        Index(
+            "ix_user_full_name_trgm",
+            "full_name",
+            postgresql_using="gin",
+            postgresql_ops={"full_name": "gin_trgm_ops"},
+        ).ddl_if(dialect="postgresql"),
+    )
+    
+    @validates("email")
+    def _set_email_lower(self, key: str, email: str) -> str:
+        self.email_lower = email.lower() if email is not None else None
+        return email
 
 
 class RefreshToken(Base):
-    id = Column(String, primary_key=True, index=True)
-    token = Column(String, nullable=False, index=True)
+    id = Column(GUID, primary_key=True, index=True, default=uuid7)
+    token = Column(GUID, nullable=False, index=True)
     expires_at = Column(DateTime, nullable=False)
-    user_id = Column(String, ForeignKey("user.id", ondelete="CASCADE"), nullable=False)
+    user_id = Column(GUID, ForeignKey("user.id", ondelete="CASCADE"), nullable=False, index=True)
     
-    user = relationship("User", back_populates="refresh_tokens") 
\ No newline at end of file
+    user = relationship("User", back_populates="refresh_tokens") 
+
+
+# gin_trgm_ops comes from the pg_trgm extension
+event.listen(
+    Base.metadata,
+    "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"),
+)
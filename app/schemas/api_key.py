@@ -0,0 +1,53 @@
+import uuid
+from datetime import datetime
+from pydantic import BaseModel, field_validator
+from typing import List, Optional
+
+from app.services.auth_service import ActionEnum, ResourceEnum
+
+
+class ApiKeyBase(BaseModel):
+    name: str
+    scopes: List[str] = []
+
+    @field_validator("scopes", mode="before")
+    @classmethod
+    def split_scopes(cls, value):
+        # Scopes are stored as a space separated string
+        if isinstance(value, str):
+            return value.split()
+        return value
+
+    @field_validator("scopes")
+    @classmethod
+    def validate_scopes(cls, value: List[str]) -> List[str]:
+        for scope in value:
+            resource, _, action = scope.partition(":")
+            try:
+                ResourceEnum(resource)
+                ActionEnum(action)
+            except ValueError:
+                raise ValueError(f"Invalid scope {scope!r}, expected <resource>:<action>")
+        return value
+
+
+class ApiKeyCreate(ApiKeyBase):
+    user_id: uuid.UUID
+    expires_in_days: Optional[int] = None
+
+
+class ApiKey(ApiKeyBase):
+    id: uuid.UUID
+    user_id: uuid.UUID
+    prefix: str
+    is_active: bool
+    created_at: datetime
+    expires_at: Optional[datetime] = None
+    last_used_at: Optional[datetime] = None
+    
+    class Config:
+        orm_mode = True
+
+
+class ApiKeyCreated(ApiKey):
+    key: str
@@ -1,5 +1,7 @@
+import uuid
+from datetime import datetime
 from pydantic import BaseModel, EmailStr, Field
-from typing import Optional
+from typing import List, Optional
 from app.models.user import RoleEnum
 
 
@@ -20,7 +22,7 @@ class UserUpdate(UserBase):
 
 
 class UserInDBBase(UserBase):
-    id: str
+    id: uuid.UUID
     
     class Config:
         orm_mode = True
@@ -31,4 +33,21 @@ class User(UserInDBBase):
 
 
 class UserInDB(UserInDBBase):
-    hashed_password: str 
\ No newline at end of file
+    hashed_password: str 
+
+
+class UserSearchResult(BaseModel):
+    items: List[User]
+    # Pass as `cursor` to get the next page; None on the last page
+    next_cursor: Optional[str] = None
+
+
+class UserBulkFilter(BaseModel):
+    ids: Optional[List[uuid.UUID]] = None
+    role: Optional[RoleEnum] = None
+    is_active: Optional[bool] = None
+    created_before: Optional[datetime] = None
+
+
+class UserBulkResult(BaseModel):
+    affected: int
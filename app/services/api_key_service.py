@@ -0,0 +1,236 @@
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Collection, Dict, FrozenSet, List, NamedTuple, Optional, Tuple, Union
+
+from sqlalchemy import bindparam, update
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.security import create_api_key, get_api_key_digest, verify_api_key
+from app.db.batching import BatchWriter
+from app.db.session import SessionLocal
+from app.db.types import uuid7
+from app.models.api_key import ApiKey
+from app.models.user import User, RoleEnum
+from app.schemas.api_key import ApiKeyCreate
+from app.services.auth_service import ActionEnum, ResourceEnum
+from app.services.user_service import Principal
+
+
+class CachedApiKey(NamedTuple):
+    id: uuid.UUID
+    user_id: uuid.UUID
+    role: RoleEnum
+    # Whether the owning account is active
+    user_is_active: bool
+    key_digest: str
+    scopes: FrozenSet[str]
+    is_active: bool
+    expires_at: Optional[datetime]
+
+
+# prefix -> (key, monotonic time the entry goes stale)
+_cache: Dict[str, Tuple[CachedApiKey, float]] = {}
+# unknown prefix -> monotonic time the entry goes stale, oldest first
+_unknown_prefixes: Dict[str, float] = {}
+_unknown_prefixes_lock = threading.Lock()
+# key id -> monotonic time last_used_at was last queued for writing
+_last_recorded: Dict[uuid.UUID, float] = {}
+_last_recorded_lock = threading.Lock()
+
+
+def _remember_unknown_prefix(prefix: str, now: float) -> None:
+    with _unknown_prefixes_lock:
+        _unknown_prefixes.pop(prefix, None)
+        # Entries share one TTL, so the oldest are at the front
+        while _unknown_prefixes:
+            oldest, until = next(iter(_unknown_prefixes.items()))
+            if until > now and len(_unknown_prefixes) < settings.API_KEY_NEGATIVE_CACHE_SIZE:
+                break
+            del _unknown_prefixes[oldest]
+        _unknown_prefixes[prefix] = now + settings.API_KEY_NEGATIVE_CACHE_SECONDS
+
+
+def _is_unknown_prefix(prefix: str, now: float) -> bool:
+    until = _unknown_prefixes.get(prefix)
+    return until is not None and until > now
+
+
+def _write_last_used(batch: List[Tuple[uuid.UUID, datetime]]) -> None:
+    latest: Dict[uuid.UUID, datetime] = {}
+    for key_id, used_at in batch:
+        if key_id not in latest or latest[key_id] < used_at:
+            latest[key_id] = used_at
+
+    db = SessionLocal()
+    try:
+        # A Core statement: unlike the ORM bulk update by primary key, it
+        # skips keys deleted in the meantime instead of failing the batch
+        db.execute(
+            update(ApiKey.__table__)
+            .where(ApiKey.__table__.c.id == bindparam("key_id"))
+            .values(last_used_at=bindparam("used_at")),
+            [{"key_id": key_id, "used_at": used_at} for key_id, used_at in latest.items()],
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+last_used_writer: BatchWriter[Tuple[uuid.UUID, datetime]] = BatchWriter(
+    _write_last_used,
+    max_batch=500,
+    max_delay=1.0,
+    max_queue=10000,
+    name="api-key-last-used",
+)
+
+
+class ApiKeyService:
+    @staticmethod
+    def get_by_id(db: Session, api_key_id: uuid.UUID) -> Optional[ApiKey]:
+        return db.query(ApiKey).filter(ApiKey.id == api_key_id).first()
+
+    @staticmethod
+    def get_multi_by_user(db: Session, user_id: uuid.UUID) -> List[ApiKey]:
+        return db.query(ApiKey).filter(ApiKey.user_id == user_id).all()
+
+    @staticmethod
+    def create(db: Session, user: User, key_in: ApiKeyCreate) -> Tuple[ApiKey, str]:
+        """
+        Create an API key for a user, returning the stored key and the full
+        key, which is not stored and can only be shown once
+        """
+        prefix, api_key = create_api_key()
+        expires_at = None
+        if key_in.expires_in_days:
+            expires_at = datetime.utcnow() + timedelta(days=key_in.expires_in_days)
+
+        db_api_key = ApiKey(
+            id=uuid7(),
+            user_id=user.id,
+            name=key_in.name,
+            prefix=prefix,
+            key_digest=get_api_key_digest(api_key),
+            scopes=" ".join(key_in.scopes),
+            is_active=True,
+            expires_at=expires_at,
+        )
+        db.add(db_api_key)
+        db.commit()
+        db.refresh(db_api_key)
+        _unknown_prefixes.pop(prefix, None)
+        return db_api_key, api_key
+
+    @staticmethod
+    def revoke(db: Session, db_api_key: ApiKey) -> ApiKey:
+        db_api_key.is_active = False
+        db.add(db_api_key)
+        db.commit()
+        _cache.pop(db_api_key.prefix, None)
+        return db_api_key
+
+    @staticmethod
+    def forget_users(user_ids: Collection[uuid.UUID]) -> None:
+        """
+        Drop cached keys of users whose keys were revoked in bulk, or whose
+        role or active flag changed
+        """
+        user_ids = set(user_ids)
+        for prefix, (key, _) in list(_cache.items()):
+            if key.user_id in user_ids:
+                _cache.pop(prefix, None)
+
+    @staticmethod
+    def authenticate(db: Session, api_key: str) -> Optional[CachedApiKey]:
+        """
+        Check an API key, looking it up by prefix in a short-lived in-memory
+        cache before going to the database
+        """
+        prefix, separator, _ = api_key.partition(".")
+        if not separator:
+            return None
+
+        now = time.monotonic()
+        cached = _cache.get(prefix)
+        if cached is not None and cached[1] > now:
+            key = cached[0]
+        elif _is_unknown_prefix(prefix, now):
+            return None
+        else:
+            row = db.query(ApiKey, User.role, User.is_active).join(
+                User, ApiKey.user_id == User.id
+            ).filter(ApiKey.prefix == prefix).first()
+            if not row:
+                _remember_unknown_prefix(prefix, now)
+                return None
+            db_api_key, role, user_is_active = row
+            key = CachedApiKey(
+                id=db_api_key.id,
+                user_id=db_api_key.user_id,
+                role=role,
+                user_is_active=user_is_active,
+                key_digest=db_api_key.key_digest,
+                scopes=frozenset(db_api_key.scopes.split()),
+                is_active=db_api_key.is_active,
+                expires_at=db_api_key.expires_at,
+            )
+            _cache[prefix] = (key, now + settings.API_KEY_CACHE_SECONDS)
+
+        return ApiKeyService._check(api_key, key)
+
+    @staticmethod
+    def authenticate_cached(api_key: str) -> Tuple[bool, Optional[CachedApiKey]]:
+        """
+        Check an API key against the in-memory cache only, without blocking.
+        Returns whether the cache could decide, and the key if it is valid;
+        on a miss use authenticate
+        """
+        prefix, separator, _ = api_key.partition(".")
+        if not separator:
+            return True, None
+
+        now = time.monotonic()
+        if _is_unknown_prefix(prefix, now):
+            return True, None
+        cached = _cache.get(prefix)
+        if cached is None or cached[1] <= now:
+            return False, None
+
+        return True, ApiKeyService._check(api_key, cached[0])
+
+    @staticmethod
+    def _check(api_key: str, key: CachedApiKey) -> Optional[CachedApiKey]:
+        if not key.is_active:
+            return None
+
+        if key.expires_at is not None and key.expires_at < datetime.utcnow():
+            return None
+
+        if not verify_api_key(api_key, key.key_digest):
+            return None
+
+        ApiKeyService.record_use(key)
+        return key
+
+    @staticmethod
+    def record_use(key: CachedApiKey) -> None:
+        """
+        Queue a last_used_at update, at most once per interval for each key
+        """
+        now = time.monotonic()
+        with _last_recorded_lock:
+            last = _last_recorded.get(key.id)
+            if last is not None and now - last < settings.API_KEY_LAST_USED_INTERVAL_SECONDS:
+                return
+            _last_recorded[key.id] = now
+        # Dropping an update under load only makes last_used_at less precise
+        last_used_writer.put((key.id, datetime.utcnow()), block=False)
+
+    @staticmethod
+    def has_scope(
+        key: Union[CachedApiKey, Principal], resource: ResourceEnum, action: ActionEnum
+    ) -> bool:
+        return f"{resource.value}:{action.value}" in key.scopes
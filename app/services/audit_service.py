@@ -0,0 +1,187 @@
+import json
+import os
+import threading
+import uuid
+from datetime import datetime
+from enum import Enum
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.db.batching import BatchWriter
+from app.db.session import SessionLocal
+from app.db.types import uuid7
+from app.models.audit_event import AuditEvent
+
+
+class AuditEventType(str, Enum):
+    LOGIN = "login"
+    LOGIN_FAILED = "login_failed"
+    REFRESH = "refresh"
+    REFRESH_FAILED = "refresh_failed"
+    LOGOUT = "logout"
+    LOGOUT_ALL = "logout_all"
+    USER_CREATED = "user_created"
+    USER_UPDATED = "user_updated"
+    USER_DELETED = "user_deleted"
+    USERS_DEACTIVATED = "users_deactivated"
+    USERS_DELETED = "users_deleted"
+    API_KEY_CREATED = "api_key_created"
+    API_KEY_REVOKED = "api_key_revoked"
+
+
+def _jsonable(value: Any) -> Any:
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, (list, tuple, set)):
+        return [_jsonable(item) for item in value]
+    return value
+
+
+class DatabaseAuditSink:
+    """
+    Write a batch of audit events to the audit event table in one statement
+    """
+
+    def __init__(self, session_factory: Callable[[], Session]):
+        self.session_factory = session_factory
+
+    def __call__(self, batch: List[Dict[str, Any]]) -> None:
+        db = self.session_factory()
+        try:
+            db.execute(insert(AuditEvent), batch)
+            db.commit()
+        finally:
+            db.close()
+
+
+class JsonLinesAuditSink:
+    """
+    Append a batch of audit events to a JSON-lines file, rotating it to
+    path.1, path.2, ... once it grows past max_bytes. As with
+    logging.handlers.RotatingFileHandler, the file is never rotated when
+    max_bytes or backup_count is 0, so no events are ever thrown away
+    """
+
+    def __init__(self, path: str, max_bytes: int, backup_count: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+
+    def __call__(self, batch: List[Dict[str, Any]]) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        data = "".join(json.dumps(event, default=str) + "\n" for event in batch)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(data)
+            size = f.tell()
+        if self.max_bytes > 0 and self.backup_count > 0 and size >= self.max_bytes:
+            self.rotate()
+
+    def rotate(self) -> None:
+        for i in range(self.backup_count - 1, 0, -1):
+            source = f"{self.path}.{i}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{i + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+
+class AuditLogger:
+    """
+    Record audit events without touching the database on the request path.
+    Events go onto a bounded in-memory queue and a background thread writes
+    them to the sink in batches. When the queue is full, events are dropped
+    ("drop") or the caller waits up to block_timeout seconds first ("block")
+    """
+
+    def __init__(
+        self,
+        sink: Callable[[List[Dict[str, Any]]], None],
+        queue_size: int,
+        batch_size: int,
+        flush_interval: float,
+        overflow_policy: str = "drop",
+        block_timeout: float = 0.1,
+        enabled: bool = True,
+    ):
+        if overflow_policy not in ("drop", "block"):
+            raise ValueError(f"Unknown audit overflow policy {overflow_policy!r}")
+        self.sink = sink
+        self.enabled = enabled
+        self.overflow_policy = overflow_policy
+        self.block_timeout = block_timeout
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self.writer: BatchWriter[Dict[str, Any]] = BatchWriter(
+            lambda batch: self.sink(batch),
+            max_batch=batch_size,
+            max_delay=flush_interval,
+            max_queue=queue_size,
+            name="audit-writer",
+        )
+
+    def log(
+        self,
+        event_type: AuditEventType,
+        user_id: Optional[str] = None,
+        **details: Any,
+    ) -> bool:
+        """
+        Queue an audit event. Returns False if it was dropped
+        """
+        if not self.enabled:
+            return False
+        event = {
+            "id": uuid7(),
+            "event_type": event_type.value,
+            "user_id": user_id,
+            "created_at": datetime.utcnow(),
+            # Ids are kept as strings so the details stay JSON serializable
+            "details": {key: _jsonable(value) for key, value in details.items()} or None,
+        }
+        if self.overflow_policy == "block":
+            queued = self.writer.put(event, block=True, timeout=self.block_timeout)
+        else:
+            queued = self.writer.put(event, block=False)
+        if not queued:
+            with self._lock:
+                self.dropped += 1
+        return queued
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "queued": self.writer.queued,
+            "dropped": self.dropped,
+            "flushed": self.writer.flushed,
+            "failed": self.writer.failed,
+            "pending": self.writer.pending,
+        }
+
+    def stop(self) -> None:
+        self.writer.stop()
+
+
+def _create_sink() -> Callable[[List[Dict[str, Any]]], None]:
+    if settings.AUDIT_SINK == "file":
+        return JsonLinesAuditSink(
+            settings.AUDIT_FILE_PATH,
+            max_bytes=settings.AUDIT_FILE_MAX_BYTES,
+            backup_count=settings.AUDIT_FILE_BACKUP_COUNT,
+        )
+    if settings.AUDIT_SINK == "db":
+        return DatabaseAuditSink(SessionLocal)
+    raise ValueError(f"Unknown audit sink {settings.AUDIT_SINK!r}")
+
+
+audit_logger = AuditLogger(
+    _create_sink(),
+    queue_size=settings.AUDIT_QUEUE_SIZE,
+    batch_size=settings.AUDIT_BATCH_SIZE,
+    flush_interval=settings.AUDIT_FLUSH_INTERVAL_MS / 1000,
+    overflow_policy=settings.AUDIT_OVERFLOW_POLICY,
+    block_timeout=settings.AUDIT_BLOCK_TIMEOUT_MS / 1000,
+    enabled=settings.AUDIT_ENABLED,
+)
@@ -1,13 +1,109 @@
 from datetime import datetime, timedelta
+import threading
+import time
 import uuid
 from sqlalchemy.orm import Session
-from jose import jwt, JWTError
-from typing import Optional, Tuple
+from typing import Collection, Dict, Optional, Set, Tuple
 
 from app.core.config import settings
+from app.core.jwt_backend import jwt_backend
 from app.core.security import create_access_token, create_refresh_token
+from app.core.singleflight import SingleFlight
+from app.db.batching import GroupCommitWriter
+from app.db.session import SessionLocal
+from app.db.types import parse_uuid, uuid7
 from app.models.user import User, RefreshToken
 from app.schemas.token import TokenPayload
+from app.services.audit_service import AuditEventType, audit_logger
+
+
+# Shared by all requests when REFRESH_TOKEN_GROUP_COMMIT is enabled, so that
+# concurrent logins pay for one commit per batch instead of one each
+refresh_token_writer = GroupCommitWriter(
+    RefreshToken,
+    SessionLocal,
+    max_rows=settings.GROUP_COMMIT_MAX_ROWS,
+    max_delay=settings.GROUP_COMMIT_MAX_DELAY_MS / 1000,
+    timeout=settings.GROUP_COMMIT_TIMEOUT_SECONDS,
+)
+
+
+class RotatedTokenCache:
+    """
+    Remembers, for a short grace window, which token pair each refresh token
+    was rotated into, so clients that send the same refresh token twice
+    (several tabs, retries) get the same pair back instead of a 401
+    """
+
+    def __init__(self, grace_seconds: int):
+        self.grace_seconds = grace_seconds
+        # old refresh token -> (user id, new token pair, monotonic expiry)
+        self._entries: Dict[str, Tuple[uuid.UUID, Tuple[str, str], float]] = {}
+        # Reverse indexes so revocations do not scan every entry
+        # new refresh token -> old refresh token
+        self._by_new_token: Dict[str, str] = {}
+        # user id -> old refresh tokens
+        self._by_user: Dict[uuid.UUID, Set[str]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, refresh_token: str) -> Optional[Tuple[str, str]]:
+        entry = self._entries.get(refresh_token)
+        if entry is None or entry[2] < time.monotonic():
+            return None
+        return entry[1]
+
+    def add(self, refresh_token: str, user_id: uuid.UUID, tokens: Tuple[str, str]) -> None:
+        if self.grace_seconds <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            # Entries are inserted in expiry order, so expired ones are at the front
+            while self._entries:
+                token, entry = next(iter(self._entries.items()))
+                if entry[2] >= now:
+                    break
+                self._remove(token)
+            self._remove(refresh_token)
+            self._entries[refresh_token] = (user_id, tokens, now + self.grace_seconds)
+            self._by_new_token[tokens[1]] = refresh_token
+            self._by_user.setdefault(user_id, set()).add(refresh_token)
+
+    def discard_token(self, refresh_token: str) -> None:
+        """
+        Forget grace entries for, or leading to, a revoked refresh token
+        """
+        with self._lock:
+            self._remove(refresh_token)
+            old_token = self._by_new_token.get(refresh_token)
+            if old_token is not None:
+                self._remove(old_token)
+
+    def discard_user(self, user_id: uuid.UUID) -> None:
+        self.discard_users({user_id})
+
+    def discard_users(self, user_ids: Collection[uuid.UUID]) -> None:
+        with self._lock:
+            for user_id in user_ids:
+                for token in list(self._by_user.get(user_id, ())):
+                    self._remove(token)
+
+    def _remove(self, refresh_token: str) -> None:
+        # Callers hold the lock
+        entry = self._entries.pop(refresh_token, None)
+        if entry is None:
+            return
+        user_id, tokens, _ = entry
+        if self._by_new_token.get(tokens[1]) == refresh_token:
+            del self._by_new_token[tokens[1]]
+        user_tokens = self._by_user.get(user_id)
+        if user_tokens is not None:
+            user_tokens.discard(refresh_token)
+            if not user_tokens:
+                del self._by_user[user_id]
+
+
+_rotated_tokens = RotatedTokenCache(settings.REFRESH_GRACE_SECONDS)
+_refresh_flight: SingleFlight[Optional[Tuple[str, str]]] = SingleFlight()
 
 
 class TokenService:
@@ -27,8 +123,17 @@ class TokenService:
         refresh_token_expires = datetime.utcnow() + timedelta(days=settings.REFRESH_TOKEN_EXPIRE_DAYS)
         
         # Store refresh token in database
+        if settings.REFRESH_TOKEN_GROUP_COMMIT:
+            refresh_token_writer.write({
+                "id": uuid7(),
+                "token": refresh_token_str,
+                "expires_at": refresh_token_expires,
+                "user_id": user.id,
+            })
+            return access_token, refresh_token_str
+        
         db_refresh_token = RefreshToken(
-            id=str(uuid.uuid4()),
+            id=uuid7(),
             token=refresh_token_str,
             expires_at=refresh_token_expires,
             user_id=user.id
@@ -43,34 +148,47 @@ class TokenService:
         """
         Decode and validate the JWT access token
         """
-        try:
-            payload = jwt.decode(
-                token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM]
-            )
-            token_data = TokenPayload(**payload)
-            
-            if datetime.fromtimestamp(token_data.exp) < datetime.utcnow():
-                return None
-                
-            return token_data
-        except JWTError:
-            return None
+        return jwt_backend.decode_access_token(token)
     
     @staticmethod
     def refresh_tokens(refresh_token: str, db: Session) -> Optional[Tuple[str, str]]:
         """
-        Generate new access and refresh tokens using a valid refresh token
+        Generate new access and refresh tokens using a valid refresh token.
+        Concurrent calls with the same refresh token share a single rotation,
+        and a token rotated moments ago still returns the pair it was
+        rotated into
         """
+        tokens = _rotated_tokens.get(refresh_token)
+        if tokens is not None:
+            return tokens
+        
+        return _refresh_flight.do(
+            refresh_token, lambda: TokenService._rotate_refresh_token(refresh_token, db)
+        )
+    
+    @staticmethod
+    def _rotate_refresh_token(refresh_token: str, db: Session) -> Optional[Tuple[str, str]]:
+        token = parse_uuid(refresh_token)
+        if token is None:
+            audit_logger.log(AuditEventType.REFRESH_FAILED, reason="unknown_token")
+            return None
+        
         # Find the refresh token in the database
         db_refresh_token = db.query(RefreshToken).filter(
-            RefreshToken.token == refresh_token
+            RefreshToken.token == token
         ).first()
         
         if not db_refresh_token:
+            audit_logger.log(AuditEventType.REFRESH_FAILED, reason="unknown_token")
             return None
         
         # Check if the refresh token has expired
         if db_refresh_token.expires_at < datetime.utcnow():
+            audit_logger.log(
+                AuditEventType.REFRESH_FAILED,
+                user_id=db_refresh_token.user_id,
+                reason="expired",
+            )
             db.delete(db_refresh_token)
             db.commit()
             return None
@@ -78,20 +196,36 @@ class TokenService:
         # Get the user
         user = db_refresh_token.user
         
-        # Delete the old refresh token
-        db.delete(db_refresh_token)
+        # Delete the old refresh token. Another process may have rotated it
+        # in the meantime, in which case it has already been used
+        deleted = db.query(RefreshToken).filter(
+            RefreshToken.id == db_refresh_token.id
+        ).delete(synchronize_session=False)
         db.commit()
         
+        if not deleted:
+            audit_logger.log(
+                AuditEventType.REFRESH_FAILED, user_id=user.id, reason="already_rotated"
+            )
+            return None
+        
         # Create new tokens
-        return TokenService.create_tokens(user, db)
+        tokens = TokenService.create_tokens(user, db)
+        _rotated_tokens.add(refresh_token, user.id, tokens)
+        audit_logger.log(AuditEventType.REFRESH, user_id=user.id)
+        return tokens
     
     @staticmethod
     def revoke_refresh_token(refresh_token: str, db: Session) -> bool:
         """
         Revoke a refresh token (used for logout)
         """
+        token = parse_uuid(refresh_token)
+        if token is None:
+            return False
+        
         db_refresh_token = db.query(RefreshToken).filter(
-            RefreshToken.token == refresh_token
+            RefreshToken.token == token
         ).first()
         
         if not db_refresh_token:
@@ -99,10 +233,11 @@ class TokenService:
         
         db.delete(db_refresh_token)
         db.commit()
+        _rotated_tokens.discard_token(refresh_token)
         return True
         
     @staticmethod
-    def revoke_all_user_tokens(user_id: str, db: Session) -> bool:
+    def revoke_all_user_tokens(user_id: uuid.UUID, db: Session) -> bool:
         """
         Revoke all refresh tokens for a user (used for force logout)
         """
@@ -110,4 +245,12 @@ class TokenService:
             RefreshToken.user_id == user_id
         ).delete()
         db.commit()
-        return True 
\ No newline at end of file
+        _rotated_tokens.discard_user(user_id)
+        return True
+    
+    @staticmethod
+    def forget_users(user_ids: Collection[uuid.UUID]) -> None:
+        """
+        Drop the grace entries of users whose tokens were revoked in bulk
+        """
+        _rotated_tokens.discard_users(set(user_ids)) 
\ No newline at end of file
@@ -1,25 +1,135 @@
+import time
 import uuid
-from typing import Optional
+from typing import Any, Collection, Dict, FrozenSet, List, NamedTuple, Optional, Tuple, Union
+from sqlalchemy import and_, delete, or_, select, update
+from sqlalchemy.engine import Row
 from sqlalchemy.orm import Session
 
-from app.models.user import User
-from app.schemas.user import UserCreate, UserUpdate
+from app.core.config import settings
+from app.db.types import parse_uuid, uuid7
+from app.models.api_key import ApiKey
+from app.models.user import User, RefreshToken, RoleEnum
+from app.schemas.user import UserBulkFilter, UserCreate, UserUpdate
 from app.core.security import get_password_hash, verify_password
 
 
+class Principal(NamedTuple):
+    """
+    The authenticated user, as far as authorization needs to know it
+    """
+    id: uuid.UUID
+    role: RoleEnum
+    is_active: bool
+    # Scopes of the API key used, None when authenticated with a token
+    scopes: Optional[FrozenSet[str]] = None
+
+
+# user id (token subject) -> (principal or None for unknown users, monotonic
+# time the entry goes stale)
+_principal_cache: Dict[str, Tuple[Optional[Principal], float]] = {}
+
+
 class UserService:
     @staticmethod
     def get_by_email(db: Session, email: str) -> Optional[User]:
         return db.query(User).filter(User.email == email).first()
     
     @staticmethod
-    def get_by_id(db: Session, user_id: str) -> Optional[User]:
+    def get_by_id(db: Session, user_id: Union[str, uuid.UUID]) -> Optional[User]:
         return db.query(User).filter(User.id == user_id).first()
     
+    @staticmethod
+    def get_principal(db: Session, user_id: Union[str, uuid.UUID]) -> Optional[Principal]:
+        """
+        Load only the columns authorization needs, without building a User
+        """
+        row = db.execute(
+            select(User.id, User.role, User.is_active).where(User.id == user_id)
+        ).first()
+        if row is None:
+            return None
+        return Principal(id=row.id, role=row.role, is_active=row.is_active)
+    
+    @staticmethod
+    def get_cached_principal(user_id: str) -> Tuple[bool, Optional[Principal]]:
+        """
+        Look a principal up in the short-lived in-memory cache only, without
+        blocking. Returns whether the cache could decide, and the principal
+        (None for a user that does not exist); on a miss use load_principal
+        """
+        cached = _principal_cache.get(user_id)
+        if cached is None or cached[1] <= time.monotonic():
+            return False, None
+        return True, cached[0]
+    
+    @staticmethod
+    def load_principal(db: Session, user_id: str) -> Optional[Principal]:
+        """
+        Load a principal and cache it for PRINCIPAL_CACHE_SECONDS
+        """
+        user_uuid = parse_uuid(user_id)
+        principal = UserService.get_principal(db, user_uuid) if user_uuid else None
+        now = time.monotonic()
+        if len(_principal_cache) > 10000:
+            for key, (_, until) in list(_principal_cache.items()):
+                if until <= now:
+                    _principal_cache.pop(key, None)
+        _principal_cache[user_id] = (principal, now + settings.PRINCIPAL_CACHE_SECONDS)
+        return principal
+    
+    @staticmethod
+    def forget_principals(user_ids: Collection[uuid.UUID]) -> None:
+        """
+        Drop cached principals of users whose role or active flag changed
+        """
+        for user_id in user_ids:
+            _principal_cache.pop(str(user_id), None)
+    
+    @staticmethod
+    def get_profile(db: Session, user_id: Union[str, uuid.UUID]) -> Optional[Row]:
+        """
+        Load the columns of the public user schema
+        """
+        return db.execute(
+            select(User.id, User.email, User.full_name, User.is_active, User.role)
+            .where(User.id == user_id)
+        ).first()
+    
+    @staticmethod
+    def search(
+        db: Session,
+        email_prefix: Optional[str] = None,
+        name: Optional[str] = None,
+        limit: int = 20,
+        after: Optional[Tuple[str, uuid.UUID]] = None,
+    ) -> List[User]:
+        """
+        Find users whose email starts with `email_prefix` and whose full name
+        contains `name`, both case-insensitively, ordered by email. `after`
+        is the (email_lower, id) of the last user of the previous page
+        """
+        query = db.query(User)
+        if email_prefix:
+            prefix = email_prefix.lower()
+            # A range on the indexed column instead of LIKE, which SQLite
+            # only serves from an index for case-sensitive matching
+            upper = prefix[:-1] + chr(min(ord(prefix[-1]) + 1, 0x10FFFF))
+            query = query.filter(User.email_lower >= prefix, User.email_lower < upper)
+        if name:
+            pattern = name.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            query = query.filter(User.full_name.ilike(f"%{pattern}%", escape="\\"))
+        if after is not None:
+            email_lower, user_id = after
+            query = query.filter(or_(
+                User.email_lower > email_lower,
+                and_(User.email_lower == email_lower, User.id > user_id),
+            ))
+        return query.order_by(User.email_lower, User.id).limit(limit).all()
+    
     @staticmethod
     def create(db: Session, user_in: UserCreate) -> User:
         user = User(
-            id=str(uuid.uuid4()),
+            id=uuid7(),
             email=user_in.email,
             hashed_password=get_password_hash(user_in.password),
             full_name=user_in.full_name,
@@ -46,13 +156,88 @@ class UserService:
         db.refresh(db_user)
         return db_user
     
+    @staticmethod
+    def delete(db: Session, user_id: uuid.UUID) -> bool:
+        """
+        Delete a user without loading it; refresh tokens and API keys go with
+        it through ON DELETE CASCADE
+        """
+        deleted = db.query(User).filter(User.id == user_id).delete(synchronize_session=False)
+        db.commit()
+        return bool(deleted)
+    
+    @staticmethod
+    def _bulk_conditions(user_filter: UserBulkFilter, exclude_user_id: uuid.UUID) -> List[Any]:
+        conditions = [User.id != exclude_user_id]
+        if user_filter.ids is not None:
+            conditions.append(User.id.in_(user_filter.ids))
+        if user_filter.role is not None:
+            conditions.append(User.role == user_filter.role)
+        if user_filter.is_active is not None:
+            conditions.append(User.is_active == user_filter.is_active)
+        if user_filter.created_before is not None:
+            conditions.append(User.created_at < user_filter.created_before)
+        return conditions
+    
+    @staticmethod
+    def _revoke_credentials(db: Session, conditions: List[Any]) -> None:
+        user_ids = select(User.id).where(*conditions)
+        db.execute(
+            delete(RefreshToken).where(RefreshToken.user_id.in_(user_ids)),
+            execution_options={"synchronize_session": False},
+        )
+        db.execute(
+            update(ApiKey).where(ApiKey.user_id.in_(user_ids)).values(is_active=False),
+            execution_options={"synchronize_session": False},
+        )
+    
+    @staticmethod
+    def bulk_deactivate(
+        db: Session, user_filter: UserBulkFilter, exclude_user_id: uuid.UUID
+    ) -> List[uuid.UUID]:
+        """
+        Deactivate every user matching the filter and revoke their refresh
+        tokens and API keys in one transaction. Returns the affected ids
+        """
+        conditions = UserService._bulk_conditions(user_filter, exclude_user_id)
+        user_ids = list(db.scalars(select(User.id).where(*conditions)))
+        # Credentials first, while the users still match an is_active filter
+        UserService._revoke_credentials(db, conditions)
+        db.execute(
+            update(User).where(*conditions).values(is_active=False),
+            execution_options={"synchronize_session": False},
+        )
+        db.commit()
+        return user_ids
+    
+    @staticmethod
+    def bulk_delete(
+        db: Session, user_filter: UserBulkFilter, exclude_user_id: uuid.UUID
+    ) -> List[uuid.UUID]:
+        """
+        Delete every user matching the filter together with their refresh
+        tokens and API keys in one transaction. Returns the affected ids
+        """
+        conditions = UserService._bulk_conditions(user_filter, exclude_user_id)
+        user_ids = list(db.scalars(select(User.id).where(*conditions)))
+        UserService._revoke_credentials(db, conditions)
+        db.execute(
+            delete(User).where(*conditions),
+            execution_options={"synchronize_session": False},
+        )
+        db.commit()
+        return user_ids
+    
     @staticmethod
     def authenticate(db: Session, email: str, password: str) -> Optional[User]:
         user = UserService.get_by_email(db, email)
+        # End the read transaction so the connection goes back to the pool
+        # while the (deliberately slow) password hash is checked
+        db.commit()
         if not user or not verify_password(password, user.hashed_password):
             return None
         return user
     
     @staticmethod
-    def is_active(user: User) -> bool:
+    def is_active(user: Union[User, Principal, Row]) -> bool:
         return user.is_active 
\ No newline at end of file
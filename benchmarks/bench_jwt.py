@@ -0,0 +1,31 @@
+"""
+Compare access token encode/decode throughput of the JWT backends
+
+    python -m benchmarks.bench_jwt
+"""
+import time
+import timeit
+
+from app.core.config import settings
+from app.core.jwt_backend import HMACJWTBackend, JoseJWTBackend
+
+ITERATIONS = 20000
+
+
+def bench(backend) -> None:
+    claims = {"exp": int(time.time()) + 1800, "sub": "0b7c1e4e-6a39-4f7a-9d0c-3f4d3a1f2c55", "role": "user"}
+    token = backend.encode(claims)
+    assert backend.decode_access_token(token) is not None
+
+    encode = timeit.timeit(lambda: backend.encode(claims), number=ITERATIONS)
+    decode = timeit.timeit(lambda: backend.decode_access_token(token), number=ITERATIONS)
+    print(
+        f"{type(backend).__name__:<16} "
+        f"encode {ITERATIONS / encode:>10,.0f}/s  "
+        f"decode {ITERATIONS / decode:>10,.0f}/s"
+    )
+
+
+if __name__ == "__main__":
+    for backend_class in (JoseJWTBackend, HMACJWTBackend):
+        bench(backend_class(settings.SECRET_KEY, settings.ALGORITHM))
@@ -38,6 +38,10 @@ else:
     sys.exit(1)
 "
 
+# Migrate existing data
+echo "Migrating database..."
+python /app/migrate_db.py
+
 # Initialize the database
 echo "Initializing database..."
 cd /app
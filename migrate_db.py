@@ -0,0 +1,163 @@
+import logging
+import os
+import sys
+
+from sqlalchemy import MetaData, String, Table, inspect, text
+from sqlalchemy.engine import Connection, Engine
+
+# Add the parent directory to the path
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+from app.db.base import Base
+from app.db.session import engine
+from app.db.types import GUID
+from app.models.api_key import ApiKey
+from app.models.audit_event import AuditEvent
+from app.models.user import User, RefreshToken
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Tables with UUID columns, parents before children
+UUID_TABLES = [User.__table__, RefreshToken.__table__, ApiKey.__table__, AuditEvent.__table__]
+
+# Foreign keys dropped while their columns change type: (table, constraint, column)
+UUID_FOREIGN_KEYS = [
+    ("refreshtoken", "refreshtoken_user_id_fkey", "user_id"),
+    ("apikey", "apikey_user_id_fkey", "user_id"),
+]
+
+
+def _uuid_columns(table: Table):
+    return [column.name for column in table.columns if isinstance(column.type, GUID)]
+
+
+def _migrate_uuid_keys_postgresql(connection: Connection) -> None:
+    existing = set(inspect(connection).get_table_names())
+    for table_name, constraint, _ in UUID_FOREIGN_KEYS:
+        if table_name in existing:
+            connection.execute(text(
+                f'ALTER TABLE "{table_name}" DROP CONSTRAINT IF EXISTS "{constraint}"'
+            ))
+
+    for table in UUID_TABLES:
+        if table.name not in existing:
+            continue
+        changes = ", ".join(
+            f'ALTER COLUMN "{column}" TYPE uuid USING "{column}"::uuid'
+            for column in _uuid_columns(table)
+        )
+        logger.info("Converting %s to uuid columns", table.name)
+        connection.execute(text(f'ALTER TABLE "{table.name}" {changes}'))
+
+    for table_name, constraint, column in UUID_FOREIGN_KEYS:
+        if table_name in existing:
+            connection.execute(text(
+                f'ALTER TABLE "{table_name}" ADD CONSTRAINT "{constraint}" '
+                f'FOREIGN KEY ("{column}") REFERENCES "user" (id) ON DELETE CASCADE'
+            ))
+
+
+def _migrate_uuid_keys_copy(connection: Connection) -> None:
+    # Databases without ALTER COLUMN TYPE (SQLite) get their tables rebuilt:
+    # read the rows with the old schema, recreate the tables, write them back
+    existing = set(inspect(connection).get_table_names())
+    rows = {}
+    for table in UUID_TABLES:
+        if table.name in existing:
+            old_table = Table(table.name, MetaData(), autoload_with=connection)
+            rows[table.name] = [dict(row) for row in connection.execute(old_table.select()).mappings()]
+
+    for table in reversed(UUID_TABLES):
+        if table.name in rows:
+            connection.execute(text(f'DROP TABLE "{table.name}"'))
+    Base.metadata.create_all(bind=connection)
+
+    for row in rows.get(User.__tablename__, []):
+        # Databases older than the email search column
+        if row.get("email_lower") is None:
+            row["email_lower"] = row["email"].lower()
+
+    for table in UUID_TABLES:
+        if rows.get(table.name):
+            logger.info("Copying %d rows of %s", len(rows[table.name]), table.name)
+            connection.execute(table.insert(), rows[table.name])
+
+
+def _needs_uuid_migration(connection: Connection) -> bool:
+    inspector = inspect(connection)
+    if not inspector.has_table("user"):
+        return False
+    # Before the migration ids were stored as strings
+    id_column = next(c for c in inspector.get_columns("user") if c["name"] == "id")
+    return isinstance(id_column["type"], String)
+
+
+def migrate_uuid_keys(target: Engine = engine) -> None:
+    """
+    Convert the string ids of existing databases to native UUID columns
+    (PostgreSQL) or 16-byte binary columns (other databases)
+    """
+    with target.begin() as connection:
+        if not _needs_uuid_migration(connection):
+            logger.info("Id columns already use the UUID type")
+            return
+        if connection.dialect.name == "postgresql":
+            _migrate_uuid_keys_postgresql(connection)
+        else:
+            _migrate_uuid_keys_copy(connection)
+
+
+def add_refresh_token_user_index(target: Engine = engine) -> None:
+    """
+    Index refreshtoken.user_id, which ON DELETE CASCADE and the bulk token
+    revocation look rows up by
+    """
+    with target.begin() as connection:
+        if not inspect(connection).has_table("refreshtoken"):
+            return
+        connection.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_refreshtoken_user_id ON refreshtoken (user_id)"
+        ))
+
+
+def add_email_lower(target: Engine = engine) -> None:
+    """
+    Add and backfill the lowercased email column used by user search, and
+    the search indexes
+    """
+    with target.begin() as connection:
+        inspector = inspect(connection)
+        if not inspector.has_table("user"):
+            return
+        postgresql = connection.dialect.name == "postgresql"
+        columns = {column["name"] for column in inspector.get_columns("user")}
+        if "email_lower" not in columns:
+            logger.info("Adding user.email_lower")
+            collation = ' COLLATE "C"' if postgresql else ""
+            connection.execute(text(f'ALTER TABLE "user" ADD COLUMN email_lower VARCHAR{collation}'))
+        connection.execute(text(
+            'UPDATE "user" SET email_lower = lower(email) WHERE email_lower IS NULL'
+        ))
+        if postgresql:
+            connection.execute(text('ALTER TABLE "user" ALTER COLUMN email_lower SET NOT NULL'))
+            connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        search_indexes = {"ix_user_email_lower_id"}
+        if postgresql:
+            search_indexes.add("ix_user_full_name_trgm")
+        for index in User.__table__.indexes:
+            if index.name in search_indexes:
+                index.create(connection, checkfirst=True)
+
+
+def migrate() -> None:
+    migrate_uuid_keys()
+    add_refresh_token_user_index()
+    add_email_lower()
+
+
+if __name__ == "__main__":
+    logger.info("Migrating database")
+    migrate()
+    logger.info("Database migrated")
@@ -0,0 +1,89 @@
+import anyio
+import pytest
+from fastapi.testclient import TestClient
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+
+from app.core.middleware import AdmissionControlMiddleware, AdmissionController
+
+
+def make_controller():
+    return AdmissionController(
+        {"login": 1, "verify": 0, "default": 2},
+        {"login": 50, "default": 0},
+        api_prefix="/api/v1",
+    )
+
+
+def test_classify_routes():
+    controller = make_controller()
+    assert controller.classify("/api/v1/auth/login") == "login"
+    assert controller.classify("/api/v1/auth/refresh") == "refresh"
+    assert controller.classify("/api/v1/auth/verify") == "verify"
+    assert controller.classify("/api/v1/users") == "admin"
+    assert controller.classify("/api/v1/api-keys/abc") == "admin"
+    assert controller.classify("/api/v1/users/me") == "default"
+    assert controller.classify("/") == "default"
+
+
+def test_requests_over_the_limit_are_shed_after_the_queue_timeout():
+    controller = make_controller()
+
+    async def main():
+        assert await controller.acquire("login")
+        # Waits for the 50 ms queue timeout, then gives up
+        assert not await controller.acquire("login")
+        controller.release("login")
+        assert await controller.acquire("login")
+
+        # No queue timeout: shed at once
+        assert await controller.acquire("default")
+        assert await controller.acquire("default")
+        assert not await controller.acquire("default")
+
+        # A limit of 0 means unlimited
+        for _ in range(10):
+            assert await controller.acquire("verify")
+
+    anyio.run(main)
+    stats = controller.stats()
+    assert stats["login"] == {"limit": 1, "in_flight": 1, "shed": 1}
+    assert stats["default"] == {"limit": 2, "in_flight": 2, "shed": 1}
+
+
+def test_waiting_request_gets_a_freed_slot():
+    controller = make_controller()
+    admitted = []
+
+    async def main():
+        assert await controller.acquire("login")
+        async with anyio.create_task_group() as tg:
+            async def wait():
+                admitted.append(await controller.acquire("login"))
+            tg.start_soon(wait)
+            await anyio.sleep(0.01)
+            controller.release("login")
+
+    anyio.run(main)
+    assert admitted == [True]
+
+
+def test_middleware_responds_503_when_shedding():
+    controller = AdmissionController({"default": 1}, {"default": 0}, api_prefix="/api/v1")
+    app = Starlette(routes=[Route("/", lambda request: PlainTextResponse("ok"))])
+    client = TestClient(AdmissionControlMiddleware(app, controller=controller))
+
+    assert client.get("/").status_code == 200
+
+    anyio.run(controller.acquire, "default")
+    response = client.get("/")
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "1"
+
+
+def test_limits_must_fit_the_thread_pool():
+    controller = make_controller()
+    controller.check_capacity(threads=3)
+    with pytest.raises(ValueError):
+        controller.check_capacity(threads=2)
@@ -0,0 +1,41 @@
+import json
+import time
+
+from app.services.audit_service import AuditEventType, AuditLogger, JsonLinesAuditSink
+
+
+def test_audit_logger_drops_events_when_queue_is_full():
+    def slow_sink(batch):
+        time.sleep(0.2)
+
+    audit = AuditLogger(slow_sink, queue_size=2, batch_size=1, flush_interval=0)
+
+    results = [audit.log(AuditEventType.LOGIN, user_id="user-1") for _ in range(10)]
+    audit.stop()
+
+    stats = audit.stats()
+    assert results.count(False) == stats["dropped"] > 0
+    assert stats["queued"] == stats["flushed"] == results.count(True)
+
+
+def test_json_lines_sink_rotates(tmp_path):
+    path = tmp_path / "audit.jsonl"
+    sink = JsonLinesAuditSink(str(path), max_bytes=100, backup_count=2)
+
+    for i in range(3):
+        sink([{"event_type": "login", "user_id": f"user-{i}", "details": "x" * 80}])
+
+    assert not path.exists()
+    assert json.loads((tmp_path / "audit.jsonl.1").read_text())["user_id"] == "user-2"
+    assert json.loads((tmp_path / "audit.jsonl.2").read_text())["user_id"] == "user-1"
+
+
+def test_json_lines_sink_without_backups_keeps_every_event(tmp_path):
+    path = tmp_path / "audit.jsonl"
+    sink = JsonLinesAuditSink(str(path), max_bytes=100, backup_count=0)
+
+    for i in range(3):
+        sink([{"event_type": "login", "user_id": f"user-{i}", "details": "x" * 80}])
+
+    lines = path.read_text().splitlines()
+    assert [json.loads(line)["user_id"] for line in lines] == ["user-0", "user-1", "user-2"]
@@ -10,7 +10,9 @@ from app.db.base import Base
 from app.db.session import get_db
 from app.services.user_service import UserService
 from app.schemas.user import UserCreate
+from app.models.audit_event import AuditEvent
 from app.models.user import RoleEnum
+from app.services.audit_service import DatabaseAuditSink, audit_logger
 
 
 # Create an in-memory SQLite database for testing
@@ -35,6 +37,7 @@ def override_get_db():
 
 
 app.dependency_overrides[get_db] = override_get_db
+audit_logger.sink = DatabaseAuditSink(TestingSessionLocal)
 
 client = TestClient(app)
 
@@ -50,6 +53,9 @@ def db_session():
 
 @pytest.fixture(scope="function")
 def test_user(db_session):
+    user = UserService.get_by_email(db_session, email="test@example.com")
+    if user:
+        return user
     user_in = UserCreate(
         email="test@example.com",
         password="password123",
@@ -96,4 +102,379 @@ def test_get_user_me(test_user):
     user_data = response.json()
     assert user_data["email"] == "test@example.com"
     assert user_data["full_name"] == "Test User"
-    assert user_data["role"] == "admin" 
\ No newline at end of file
+    assert user_data["role"] == "admin" 
+
+def test_get_user_me_runs_one_query(test_user):
+    from sqlalchemy import event
+
+    headers = _admin_headers()
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        response = client.get("/api/v1/users/me", headers=headers)
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+    assert response.status_code == 200
+    assert len([s for s in statements if s.lstrip().upper().startswith("SELECT")]) == 1
+
+
+def test_get_user_me_of_deleted_user(db_session):
+    from app.core.security import create_access_token
+
+    token = create_access_token(str(uuid.uuid4()), RoleEnum.USER.value)
+    response = client.get(
+        "/api/v1/users/me", headers={"Authorization": f"Bearer {token}"}
+    )
+    assert response.status_code == 404
+
+
+def test_api_key_authentication(test_user, db_session, monkeypatch):
+    from app.services import api_key_service
+    monkeypatch.setattr(api_key_service, "SessionLocal", TestingSessionLocal)
+
+    service_user = UserService.get_by_email(db_session, email="service@example.com")
+    if not service_user:
+        service_user = UserService.create(db_session, user_in=UserCreate(
+            email="service@example.com",
+            password="password123",
+            role=RoleEnum.SERVICE,
+        ))
+
+    login_response = client.post(
+        "/api/v1/auth/login",
+        data={"username": "test@example.com", "password": "password123"},
+    )
+    tokens = login_response.json()
+    response = client.post(
+        "/api/v1/api-keys",
+        json={"name": "ci", "user_id": str(service_user.id), "scopes": ["users:list"]},
+        headers={"Authorization": f"Bearer {tokens['access_token']}"},
+    )
+    assert response.status_code == 201
+    api_key = response.json()["key"]
+
+    response = client.get("/api/v1/users", headers={"X-API-Key": api_key})
+    assert response.status_code == 200
+
+    # The service role may read users, but the key was not issued that scope
+    response = client.get(
+        f"/api/v1/users/{service_user.id}", headers={"X-API-Key": api_key}
+    )
+    assert response.status_code == 403
+
+    response = client.get("/api/v1/users", headers={"X-API-Key": api_key + "x"})
+    assert response.status_code == 401
+
+    # Self-service endpoints need a bearer token, whatever the key's scopes
+    key_headers = {"X-API-Key": api_key}
+    assert client.get("/api/v1/users/me", headers=key_headers).status_code == 403
+    response = client.put(
+        "/api/v1/users/me", json={"password": "changed123"}, headers=key_headers
+    )
+    assert response.status_code == 403
+    response = client.post(
+        "/api/v1/auth/logout", params={"refresh_token": "x"}, headers=key_headers
+    )
+    assert response.status_code == 403
+    assert client.post("/api/v1/auth/logout-all", headers=key_headers).status_code == 403
+
+    # Cached keys are checked on the event loop, without a worker thread
+    from app.api.endpoints import verify
+
+    def no_threadpool(*args, **kwargs):
+        raise AssertionError("verify used the threadpool for a cached key")
+
+    monkeypatch.setattr(verify, "run_in_threadpool", no_threadpool)
+    response = client.get("/api/v1/auth/verify", headers=key_headers)
+    assert response.status_code == 200
+    assert response.headers["x-user-id"] == str(service_user.id)
+    response = client.get("/api/v1/auth/verify", headers={"X-API-Key": api_key + "x"})
+    assert response.status_code == 401
+
+    # Flush last_used_at updates while the test session factory is patched in
+    api_key_service.last_used_writer.stop()
+
+
+def test_verify(test_user, monkeypatch):
+    from app.api.endpoints import verify
+    monkeypatch.setattr(verify, "SessionLocal", TestingSessionLocal)
+
+    login_response = client.post(
+        "/api/v1/auth/login",
+        data={"username": "test@example.com", "password": "password123"},
+    )
+    tokens = login_response.json()
+    headers = {"Authorization": f"Bearer {tokens['access_token']}"}
+
+    response = client.get("/api/v1/auth/verify", headers=headers)
+    assert response.status_code == 200
+    assert response.headers["X-User-Id"] == str(test_user.id)
+    assert response.headers["X-User-Role"] == "admin"
+    assert response.content == b""
+
+    response = client.get(
+        "/api/v1/auth/verify",
+        headers={**headers, "X-Auth-Resource": "settings", "X-Auth-Action": "delete"},
+    )
+    assert response.status_code == 403
+
+    response = client.get("/api/v1/auth/verify", headers={"Authorization": "Bearer bad"})
+    assert response.status_code == 401
+
+
+def test_verify_rejects_deactivated_users(test_user, db_session, monkeypatch):
+    from app.api.endpoints import verify
+    monkeypatch.setattr(verify, "SessionLocal", TestingSessionLocal)
+
+    email = f"verify-{uuid.uuid4().hex[:8]}@example.com"
+    user = UserService.create(db_session, user_in=UserCreate(email=email, password="password123"))
+    login_response = client.post(
+        "/api/v1/auth/login", data={"username": email, "password": "password123"}
+    )
+    headers = {"Authorization": f"Bearer {login_response.json()['access_token']}"}
+    assert client.get("/api/v1/auth/verify", headers=headers).status_code == 200
+
+    response = client.put(
+        f"/api/v1/users/{user.id}", json={"is_active": False}, headers=_admin_headers()
+    )
+    assert response.status_code == 200
+    assert client.get("/api/v1/auth/verify", headers=headers).status_code == 401
+
+
+def test_login_is_audited(test_user, db_session):
+    client.post(
+        "/api/v1/auth/login",
+        data={"username": "test@example.com", "password": "wrong_password"},
+    )
+    client.post(
+        "/api/v1/auth/login",
+        data={"username": "test@example.com", "password": "password123"},
+    )
+    # Stopping the writer flushes everything still queued
+    audit_logger.stop()
+
+    event_types = [
+        event.event_type
+        for event in db_session.query(AuditEvent).order_by(AuditEvent.created_at)
+    ]
+    assert event_types[-2:] == ["login_failed", "login"]
+
+
+def test_refresh_token_reuse_within_grace_window(test_user):
+    login_response = client.post(
+        "/api/v1/auth/login",
+        data={"username": "test@example.com", "password": "password123"},
+    )
+    refresh_token = login_response.json()["refresh_token"]
+
+    first = client.post("/api/v1/auth/refresh", params={"refresh_token": refresh_token})
+    second = client.post("/api/v1/auth/refresh", params={"refresh_token": refresh_token})
+    assert first.status_code == second.status_code == 200
+    assert first.json() == second.json()
+
+    # The new refresh token is a normal single-use token
+    new_refresh_token = first.json()["refresh_token"]
+    response = client.post("/api/v1/auth/refresh", params={"refresh_token": new_refresh_token})
+    assert response.status_code == 200
+    assert response.json()["refresh_token"] != new_refresh_token
+
+
+def _admin_headers():
+    login_response = client.post(
+        "/api/v1/auth/login",
+        data={"username": "test@example.com", "password": "password123"},
+    )
+    return {"Authorization": f"Bearer {login_response.json()['access_token']}"}
+
+
+def test_bulk_deactivate_and_delete_users(test_user, db_session):
+    from app.models.user import RefreshToken, User
+
+    emails = [f"bulk-{uuid.uuid4().hex[:8]}@example.com" for _ in range(2)]
+    users = [
+        UserService.create(db_session, user_in=UserCreate(email=email, password="password123"))
+        for email in emails
+    ]
+    for email in emails:
+        client.post("/api/v1/auth/login", data={"username": email, "password": "password123"})
+    headers = _admin_headers()
+
+    response = client.post("/api/v1/users/bulk-deactivate", json={}, headers=headers)
+    assert response.status_code == 400
+
+    response = client.post(
+        "/api/v1/users/bulk-deactivate",
+        json={"ids": [str(user.id) for user in users] + [str(test_user.id)]},
+        headers=headers,
+    )
+    assert response.status_code == 200
+    assert response.json() == {"affected": 2}
+
+    db_session.expire_all()
+    assert all(not db_session.get(User, user.id).is_active for user in users)
+    assert db_session.get(User, test_user.id).is_active
+    assert db_session.query(RefreshToken).filter(
+        RefreshToken.user_id.in_([user.id for user in users])
+    ).count() == 0
+
+    response = client.delete(f"/api/v1/users/{users[0].id}", headers=headers)
+    assert response.status_code == 204
+    response = client.delete(f"/api/v1/users/{users[0].id}", headers=headers)
+    assert response.status_code == 404
+
+    response = client.post(
+        "/api/v1/users/bulk-delete", json={"ids": [str(users[1].id)]}, headers=headers
+    )
+    assert response.json() == {"affected": 1}
+    db_session.expire_all()
+    assert db_session.query(User).filter(User.email.in_(emails)).count() == 0
+
+
+def test_search_users(test_user, db_session):
+    tag = uuid.uuid4().hex[:8]
+    for i, full_name in enumerate(["Ada Lovelace", "Alan Turing", "Grace Hopper"]):
+        UserService.create(db_session, user_in=UserCreate(
+            email=f"Search{i}-{tag}@example.com", password="password123", full_name=full_name
+        ))
+    headers = _admin_headers()
+
+    response = client.get(
+        "/api/v1/users/search", params={"email": f"SEARCH0-{tag}"}, headers=headers
+    )
+    assert response.status_code == 200
+    assert [user["full_name"] for user in response.json()["items"]] == ["Ada Lovelace"]
+
+    response = client.get(
+        "/api/v1/users/search", params={"email": "search", "name": "ING"}, headers=headers
+    )
+    assert "Alan Turing" in [user["full_name"] for user in response.json()["items"]]
+
+    emails, cursor = [], None
+    while True:
+        params = {"email": "search", "limit": 2}
+        if cursor:
+            params["cursor"] = cursor
+        page = client.get("/api/v1/users/search", params=params, headers=headers).json()
+        emails += [user["email"] for user in page["items"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert [f"Search{i}-{tag}@example.com" for i in range(3)] == [
+        email for email in emails if tag in email
+    ]
+    assert emails == sorted(emails, key=str.lower)
+
+    response = client.get("/api/v1/users/search", headers=headers)
+    assert response.status_code == 400
+    response = client.get(
+        "/api/v1/users/search", params={"email": "a", "cursor": "nope"}, headers=headers
+    )
+    assert response.status_code == 400
+
+
+def test_update_user_me(test_user, db_session):
+    headers = _admin_headers()
+
+    principal = UserService.get_principal(db_session, user_id=test_user.id)
+    assert principal == (test_user.id, RoleEnum.ADMIN, True, None)
+
+    response = client.put(
+        "/api/v1/users/me", json={"role": "user"}, headers=headers
+    )
+    assert response.status_code == 400
+
+    response = client.put(
+        "/api/v1/users/me", json={"full_name": "Renamed User"}, headers=headers
+    )
+    assert response.status_code == 200
+    assert response.json()["full_name"] == "Renamed User"
+
+    response = client.put(
+        "/api/v1/users/me", json={"full_name": "Test User"}, headers=headers
+    )
+    assert response.json()["full_name"] == "Test User"
+
+
+def test_update_user_me_keeps_reads_on_primary(test_user, monkeypatch):
+    from sqlalchemy import event
+    from app.api import deps
+    from app.db import session as session_module
+    from app.db.session import ReplicaRouter
+
+    router = ReplicaRouter(["sqlite://"], retry_seconds=30, sticky_seconds=5)
+    monkeypatch.setattr(deps, "replica_router", router)
+    monkeypatch.setattr(session_module, "replica_router", router)
+    # The application registers this listener on its own sessionmaker
+    event.listen(TestingSessionLocal, "after_commit", session_module._record_write)
+    try:
+        headers = _admin_headers()
+        assert not router.is_sticky(str(test_user.id))
+
+        response = client.put(
+            "/api/v1/users/me", json={"full_name": "Test User"}, headers=headers
+        )
+        assert response.status_code == 200
+        assert router.is_sticky(str(test_user.id))
+    finally:
+        event.remove(TestingSessionLocal, "after_commit", session_module._record_write)
+
+
+def test_authentication_dependencies_stay_on_the_event_loop(test_user, monkeypatch):
+    import anyio.to_thread
+
+    headers = _admin_headers()
+    run_sync = anyio.to_thread.run_sync
+    hops = []
+
+    async def counting_run_sync(*args, **kwargs):
+        hops.append(args[0])
+        return await run_sync(*args, **kwargs)
+
+    monkeypatch.setattr(anyio.to_thread, "run_sync", counting_run_sync)
+    response = client.get("/api/v1/users", headers=headers)
+    assert response.status_code == 200
+    # Opening and closing the session, the principal query and the endpoint
+    assert len(hops) <= 5
+
+
+def test_last_used_batch_skips_deleted_keys(test_user, db_session, monkeypatch):
+    from datetime import datetime
+    from app.models.api_key import ApiKey
+    from app.schemas.api_key import ApiKeyCreate
+    from app.services import api_key_service
+    from app.services.api_key_service import ApiKeyService
+
+    monkeypatch.setattr(api_key_service, "SessionLocal", TestingSessionLocal)
+    db_api_key, _ = ApiKeyService.create(
+        db_session, user=test_user, key_in=ApiKeyCreate(name="last-used", user_id=test_user.id)
+    )
+    used_at = datetime(2030, 1, 1)
+
+    api_key_service._write_last_used([(uuid.uuid4(), used_at), (db_api_key.id, used_at)])
+
+    db_session.expire_all()
+    assert db_session.get(ApiKey, db_api_key.id).last_used_at == used_at
+
+
+def test_unknown_api_key_prefixes_are_cached(db_session):
+    from sqlalchemy import event
+    from app.services.api_key_service import ApiKeyService
+
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    made_up_key = f"{uuid.uuid4().hex[:8]}.secret"
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        assert ApiKeyService.authenticate(db_session, made_up_key) is None
+        assert ApiKeyService.authenticate(db_session, made_up_key) is None
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+    assert len(statements) == 1
+    assert ApiKeyService.authenticate_cached(made_up_key) == (True, None)
@@ -0,0 +1,124 @@
+import threading
+import uuid
+from concurrent.futures import Future
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.db.base import Base
+from app.db.batching import BatchWriter, GroupCommitWriter
+from app.models.user import RefreshToken, User
+
+
+def test_batch_writer_flushes_in_batches():
+    batches = []
+    writer = BatchWriter(batches.append, max_batch=10, max_delay=0.05)
+
+    for i in range(25):
+        writer.put(i)
+    writer.stop()
+
+    assert sorted(item for batch in batches for item in batch) == list(range(25))
+    assert all(len(batch) <= 10 for batch in batches)
+    assert writer.queued == writer.flushed == 25
+
+
+def make_session_factory():
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Base.metadata.create_all(bind=engine)
+    SessionLocal = sessionmaker(bind=engine)
+
+    user_id = uuid.uuid4()
+    db = SessionLocal()
+    db.add(User(id=user_id, email="batch@example.com", hashed_password="x"))
+    db.commit()
+    db.close()
+    return SessionLocal, user_id
+
+
+def token_row(user_id):
+    return {
+        "id": uuid.uuid4(),
+        "token": uuid.uuid4(),
+        "expires_at": datetime.utcnow(),
+        "user_id": user_id,
+    }
+
+
+def test_group_commit_writer_commits_concurrent_writes():
+    SessionLocal, user_id = make_session_factory()
+    writer = GroupCommitWriter(
+        RefreshToken, SessionLocal, max_rows=50, max_delay=0.05, timeout=5
+    )
+
+    def issue():
+        writer.write(token_row(user_id))
+
+    threads = [threading.Thread(target=issue) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    writer.stop()
+
+    db = SessionLocal()
+    assert db.query(RefreshToken).count() == 20
+    db.close()
+    assert writer.writer.batches < 20
+
+
+
+def test_group_commit_writer_fails_only_the_bad_row():
+    SessionLocal, user_id = make_session_factory()
+    writer = GroupCommitWriter(
+        RefreshToken, SessionLocal, max_rows=50, max_delay=0.1, timeout=5
+    )
+    errors = []
+
+    def issue(row):
+        try:
+            writer.write(row)
+        except IntegrityError as exc:
+            errors.append(exc)
+
+    bad_row = {**token_row(user_id), "token": None}
+    rows = [token_row(user_id) for _ in range(5)] + [bad_row]
+    threads = [threading.Thread(target=issue, args=(row,)) for row in rows]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    writer.stop()
+
+    assert len(errors) == 1
+    db = SessionLocal()
+    assert db.query(RefreshToken).count() == 5
+    db.close()
+
+
+def test_group_commit_writer_inserts_directly_after_a_timeout():
+    SessionLocal, user_id = make_session_factory()
+    writer = GroupCommitWriter(
+        RefreshToken, SessionLocal, max_rows=50, max_delay=5, timeout=0.05
+    )
+    # Keep the writer thread busy waiting for the first row's batch to fill
+    writer.writer.put((token_row(user_id), Future()))
+
+    writer.write(token_row(user_id))
+    db = SessionLocal()
+    assert db.query(RefreshToken).count() == 1
+    db.close()
+
+    # The withdrawn row is not written a second time
+    writer.stop()
+    db = SessionLocal()
+    assert db.query(RefreshToken).count() == 2
+    db.close()
@@ -0,0 +1,44 @@
+import time
+
+import pytest
+
+from app.core.jwt_backend import HMACJWTBackend, JoseJWTBackend, JWTBackend
+
+SECRET_KEY = "test-secret"
+
+
+def claims(**overrides):
+    return {"exp": int(time.time()) + 60, "sub": "user-1", "role": "admin", **overrides}
+
+
+def test_backends_are_interoperable():
+    fast = HMACJWTBackend(SECRET_KEY, "HS256")
+    jose = JoseJWTBackend(SECRET_KEY, "HS256")
+
+    for encoder, decoder in ((fast, jose), (jose, fast), (fast, fast)):
+        token_data = decoder.decode_access_token(encoder.encode(claims()))
+        assert token_data is not None
+        assert token_data.sub == "user-1"
+        assert token_data.role == "admin"
+
+
+def test_fast_backend_rejects_invalid_tokens():
+    fast = HMACJWTBackend(SECRET_KEY, "HS256")
+    token = fast.encode(claims())
+    header, payload, signature = token.split(".")
+
+    assert fast.decode_access_token(fast.encode(claims(exp=int(time.time()) - 1))) is None
+    assert fast.decode_access_token(HMACJWTBackend("other", "HS256").encode(claims())) is None
+    assert fast.decode_access_token(HMACJWTBackend(SECRET_KEY, "HS512").encode(claims())) is None
+    assert fast.decode_access_token(f"{header}.{payload}x.{signature}") is None
+    assert fast.decode_access_token(fast.encode({"exp": int(time.time()) + 60, "sub": "user-1"})) is None
+    assert fast.decode_access_token("not-a-token") is None
+
+
+def test_incomplete_backend_cannot_be_constructed():
+    class EncodeOnlyBackend(JWTBackend):
+        def encode(self, claims):
+            return ""
+
+    with pytest.raises(TypeError):
+        EncodeOnlyBackend()
@@ -0,0 +1,86 @@
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from app.db.session import LazySession, ReplicaRouter
+
+
+TestingSessionLocal = sessionmaker(bind=create_engine("sqlite://"))
+
+
+def test_replica_router_fails_over_to_primary():
+    router = ReplicaRouter(
+        ["sqlite:////nonexistent-dir/replica.db"], retry_seconds=30, sticky_seconds=5
+    )
+    assert router.connect() is None
+    # The failed replica is skipped until the retry window has passed
+    assert router._down_until
+
+
+def test_replica_router_read_your_writes():
+    router = ReplicaRouter(["sqlite://"], retry_seconds=30, sticky_seconds=5)
+    connection = router.connect(key="user-1")
+    assert connection is not None
+    connection.close()
+
+    router.record_write("user-1")
+    assert router.connect(key="user-1") is None
+
+    connection = router.connect(key="user-2")
+    assert connection is not None
+    connection.close()
+
+
+def test_lazy_session_is_built_on_first_use():
+    created = []
+
+    def factory():
+        session = TestingSessionLocal()
+        created.append(session)
+        return session
+
+    db = LazySession(factory)
+    assert created == []
+
+    assert db.execute(text("SELECT 1")).scalar() == 1
+    assert len(created) == 1
+
+    db.release()
+    assert db.execute(text("SELECT 2")).scalar() == 2
+    assert len(created) == 2
+    db.close()
+
+
+def test_health_check_reports_connection_hold_time():
+    from fastapi.testclient import TestClient
+    from sqlalchemy.pool import StaticPool
+
+    from app.db.session import get_db, track_pool_usage
+    from app.main import app
+
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    track_pool_usage(engine)
+    session_factory = sessionmaker(bind=engine)
+
+    def lazy_get_db():
+        db = LazySession(session_factory)
+        try:
+            yield db
+        finally:
+            db.close()
+
+    previous = app.dependency_overrides.get(get_db)
+    app.dependency_overrides[get_db] = lazy_get_db
+    try:
+        response = TestClient(app).get("/api/v1/health")
+    finally:
+        if previous is None:
+            del app.dependency_overrides[get_db]
+        else:
+            app.dependency_overrides[get_db] = previous
+
+    assert response.status_code == 200
+    # The connection went back to the pool before the headers were sent, so
+    # its hold time is included
+    assert float(response.headers["server-timing"].split("dur=")[1]) > 0
@@ -0,0 +1,41 @@
+import threading
+import time
+
+import pytest
+
+from app.core.singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_result():
+    flight = SingleFlight()
+    calls = []
+    results = []
+
+    def rotate():
+        calls.append(1)
+        time.sleep(0.1)
+        return object()
+
+    threads = [
+        threading.Thread(target=lambda: results.append(flight.do("token", rotate)))
+        for _ in range(5)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert len(results) == 5
+    assert all(result is results[0] for result in results)
+
+
+def test_errors_are_shared_and_not_cached():
+    flight = SingleFlight()
+
+    def fail():
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        flight.do("token", fail)
+    assert flight.do("token", lambda: 42) == 42
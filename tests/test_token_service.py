@@ -0,0 +1,22 @@
+import uuid
+
+from app.services.token_service import RotatedTokenCache
+
+
+def test_rotated_token_cache_discards_by_token_and_user():
+    cache = RotatedTokenCache(grace_seconds=10)
+    alice, bob = uuid.uuid4(), uuid.uuid4()
+    cache.add("a1", alice, ("access-a2", "a2"))
+    cache.add("a2", alice, ("access-a3", "a3"))
+    cache.add("b1", bob, ("access-b2", "b2"))
+
+    # Revoking the newest token also forgets the entry that leads to it
+    cache.discard_token("a3")
+    assert cache.get("a2") is None
+    assert cache.get("a1") == ("access-a2", "a2")
+
+    cache.discard_users({alice})
+    assert cache.get("a1") is None
+    assert cache.get("b1") == ("access-b2", "b2")
+    assert cache._by_user == {bob: {"b1"}}
+    assert cache._by_new_token == {"b2": "b1"}